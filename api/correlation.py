@@ -0,0 +1,171 @@
+import json
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# 浮動小数点誤差の蓄積を避けるため、この回数の差分更新ごとに全体を再計算する
+FULL_RECOMPUTE_INTERVAL = 500
+MAX_CACHED_STATES = 32
+
+class ReferenceNotAvailableError(Exception):
+    """基準銘柄の足が足りない、または存在しない"""
+
+class _CorrelationState:
+    """
+    整列済みの終値 (window+1本 x 銘柄数) と、そのリターン行列 R の十分統計量 (列和 S, R^T R) を保持する。
+    最新足だけが変わった場合や1本進んだ場合は、S と R^T R を行単位で差分更新する (O(N^2))。
+    """
+    def __init__(self, version, timestamps: np.ndarray, closes: np.ndarray, symbols: List[str], excluded: List[str]):
+        self.symbols = symbols
+        self.excluded = excluded
+        self._full(version, timestamps, closes)
+
+    def _full(self, version, timestamps: np.ndarray, closes: np.ndarray):
+        self.version = version
+        self.timestamps = timestamps
+        self.closes = closes
+        self.returns = closes[1:] / closes[:-1] - 1
+        self.sums = self.returns.sum(axis=0)
+        self.products = self.returns.T @ self.returns
+        self.incremental_updates = 0
+        # include_matrix -> レンダリング済みのJSON
+        self.response_bodies: Dict[bool, bytes] = {}
+
+    def _apply(self, removed: np.ndarray, added: np.ndarray):
+        """removed/addedはリターンの行 (k x N)"""
+        self.sums += added.sum(axis=0) - removed.sum(axis=0)
+        self.products += added.T @ added - removed.T @ removed
+        self.incremental_updates += 1
+        self.response_bodies.clear()
+
+    def update(self, version, timestamps: np.ndarray, closes: np.ndarray, symbols: List[str], excluded: List[str]):
+        if symbols != self.symbols or self.incremental_updates >= FULL_RECOMPUTE_INTERVAL:
+            self.symbols = symbols
+            self.excluded = excluded
+            self._full(version, timestamps, closes)
+            return
+
+        self.excluded = excluded
+        if np.array_equal(timestamps, self.timestamps):
+            if np.array_equal(closes, self.closes):
+                self.version = version
+                return
+            if np.array_equal(closes[:-1], self.closes[:-1]):
+                # 未確定の最新足だけが変わった
+                new_last = closes[-1] / closes[-2] - 1
+                self._apply(self.returns[-1:], new_last[None, :])
+                self.returns[-1] = new_last
+                self.version, self.closes = version, closes
+                return
+        elif np.array_equal(timestamps[:-1], self.timestamps[1:]) and np.array_equal(closes[:-2], self.closes[1:-1]):
+            # 1本進んだ: 最古のリターンを除き、直前の足(確定値)と新しい足のリターンを加える
+            new_tail = closes[-2:] / closes[-3:-1] - 1
+            self._apply(np.stack([self.returns[0], self.returns[-1]]), new_tail)
+            self.returns = np.concatenate([self.returns[1:-1], new_tail])
+            self.version, self.timestamps, self.closes = version, timestamps, closes
+            return
+
+        self._full(version, timestamps, closes)
+
+    def render(self, timeframe: str, window: int, reference: str, include_matrix: bool) -> bytes:
+        """相関行列とベータを計算してJSONにする。同じデータ版に対する2回目以降はキャッシュを返す"""
+        cached = self.response_bodies.get(include_matrix)
+        if cached is not None:
+            return cached
+
+        n = len(self.returns)
+        mean = self.sums / n
+        cov = (self.products - n * np.outer(mean, mean)) / (n - 1)
+        variance = np.diag(cov).copy()
+
+        ref = self.symbols.index(reference)
+        if variance[ref] <= 0:
+            raise ReferenceNotAvailableError(reference)
+        valid = variance > 0
+        excluded = self.excluded + [s for s, ok in zip(self.symbols, valid) if not ok]
+        idx = np.flatnonzero(valid)
+
+        std = np.sqrt(variance[idx])
+        corr = np.clip(cov[np.ix_(idx, idx)] / np.outer(std, std), -1.0, 1.0)
+        ref_pos = int(np.searchsorted(idx, ref))
+        beta = cov[idx, ref] / variance[ref]
+
+        symbols = [self.symbols[i] for i in idx]
+        body = {
+            "timeframe": timeframe,
+            "window": window,
+            "reference": reference,
+            "candle_ts": int(self.timestamps[-1]),
+            "count": len(symbols),
+            "data": [
+                {"symbol": s, "beta": round(float(b), 4), "correlation": round(float(c), 4)}
+                for s, b, c in zip(symbols, beta, corr[:, ref_pos])
+            ],
+            "symbols": symbols,
+            "matrix": np.round(corr, 4).tolist() if include_matrix else None,
+            "excluded": excluded,
+        }
+        self.response_bodies[include_matrix] = json.dumps(body).encode()
+        return self.response_bodies[include_matrix]
+
+_states: "OrderedDict[tuple, _CorrelationState]" = OrderedDict()
+_states_lock = threading.Lock()
+
+def _align_closes(snap, reference: str, window: int, wanted: Optional[List[str]]) -> Tuple[np.ndarray, np.ndarray, List[str], List[str]]:
+    """
+    基準銘柄の直近window+1本のタイムスタンプに揃った銘柄の終値を (window+1) x N の昇順の行列で返す。
+    同じタイムスタンプの足が揃っていない銘柄は除外する。
+    """
+    if reference not in snap.symbols:
+        raise ReferenceNotAvailableError(reference)
+    ref_group = snap.symbols.index(reference)
+    if snap.counts[ref_group] < window + 1:
+        raise ReferenceNotAvailableError(reference)
+
+    offsets = np.arange(window + 1)
+    ref_ts = snap.array["timestamp"][snap.starts[ref_group] + offsets]
+
+    if wanted:
+        wanted_set = set(wanted) | {reference}
+        groups = np.array([g for g, s in enumerate(snap.symbols) if s in wanted_set], dtype=np.int64)
+    else:
+        groups = np.arange(len(snap.symbols))
+
+    long_enough = snap.counts[groups] >= window + 1
+    candidates = groups[long_enough]
+    idx = snap.starts[candidates][:, None] + offsets[None, :]
+    aligned = np.all(snap.array["timestamp"][idx] == ref_ts[None, :], axis=1)
+
+    selected = candidates[aligned]
+    closes = snap.array["close"][idx[aligned]].T[::-1]
+    symbols = [snap.symbols[g] for g in selected]
+    excluded = [snap.symbols[g] for g in groups[~long_enough]] + [snap.symbols[g] for g in candidates[~aligned]]
+    return ref_ts[::-1].copy(), np.ascontiguousarray(closes, dtype=np.float64), symbols, excluded
+
+def get_correlation(snap, timeframe: str, window: int, reference: str, wanted: Optional[List[str]], include_matrix: bool) -> bytes:
+    """
+    スナップショット(またはDBから組み立てた同形式のデータ)から、リターンの相関行列と基準銘柄に対するベータを計算する。
+    スナップショットの版が変わっていなければキャッシュ済みの結果を返し、最新足の更新や1本の進行は差分更新で反映する。
+    DBから組み立てた場合は版がないため毎回整列し直すが、保持している終値と同じであればキャッシュ済みの結果を返す。
+    """
+    key = (timeframe, window, reference, tuple(sorted(wanted)) if wanted else None)
+    version = snap.identity
+
+    with _states_lock:
+        state = _states.get(key)
+        if state is not None:
+            _states.move_to_end(key)
+            if version is not None and state.version == version:
+                return state.render(timeframe, window, reference, include_matrix)
+
+        timestamps, closes, symbols, excluded = _align_closes(snap, reference, window, wanted)
+        if state is None:
+            state = _CorrelationState(version, timestamps, closes, symbols, excluded)
+            _states[key] = state
+            while len(_states) > MAX_CACHED_STATES:
+                _states.popitem(last=False)
+        else:
+            state.update(version, timestamps, closes, symbols, excluded)
+        return state.render(timeframe, window, reference, include_matrix)
@@ -82,6 +82,73 @@ def get_symbols_exceeding_threshold(db: Session, timeframe: str, price_threshold
     )
     return result.fetchall()
 
+import math
+from collections import namedtuple
+
+ZSCORE_MIN_SAMPLES = 30
+
+ZScoreRow = namedtuple("ZScoreRow", ["symbol", "timeframe", "candle_ts", "close", "prev_close", "volatility_pct", "zscore"])
+
+def get_symbols_by_zscore(db: Session, timeframe: str, z_threshold: float, offset: int, direction: str, sort: str, limit: int) -> List[Any]:
+    """
+    最新の足とoffset本前の足の変動を、その銘柄自身の過去の1本あたりリターンの平均・分散(return_stats)で標準化したzスコアで評価します。
+    offset本分のリターンは、平均 offset*mean・標準偏差 sqrt(offset)*std として扱います。
+    """
+    table_name = f"ohlcv_{timeframe}"
+
+    query = text(f"""
+        WITH ranked_candles AS (
+            SELECT
+                symbol,
+                timestamp,
+                close,
+                ROW_NUMBER() OVER (PARTITION BY symbol ORDER BY timestamp DESC) as rn
+            FROM {table_name}
+        )
+        SELECT
+            lc.symbol,
+            lc.timestamp as candle_ts,
+            lc.close,
+            pc.close as prev_close,
+            rs.count,
+            rs.mean,
+            rs.m2
+        FROM ranked_candles lc
+        INNER JOIN ranked_candles pc ON lc.symbol = pc.symbol AND pc.rn = 1 + :offset
+        INNER JOIN return_stats rs ON rs.timeframe = :timeframe AND rs.symbol = lc.symbol
+        WHERE lc.rn = 1 AND pc.close != 0 AND rs.count >= :min_samples
+    """)
+
+    result = db.execute(
+        query,
+        {
+            "offset": offset,
+            "timeframe": timeframe,
+            "min_samples": ZSCORE_MIN_SAMPLES
+        }
+    )
+
+    rows = []
+    for row in result:
+        std = math.sqrt(row.m2 / (row.count - 1))
+        if std == 0:
+            continue
+        change = row.close / row.prev_close - 1
+        zscore = (change - offset * row.mean) / (math.sqrt(offset) * std)
+        if abs(zscore) < z_threshold:
+            continue
+        if direction == "up" and zscore <= 0:
+            continue
+        if direction == "down" and zscore >= 0:
+            continue
+        rows.append(ZScoreRow(row.symbol, timeframe, row.candle_ts, row.close, row.prev_close, change * 100, zscore))
+
+    if sort == "symbol_asc":
+        rows.sort(key=lambda r: r.symbol)
+    else:
+        rows.sort(key=lambda r: r.zscore, reverse=(sort != "volatility_asc"))
+    return rows[:limit]
+
 from datetime import datetime, timedelta
 
 def _parse_period_to_seconds(period_str: str) -> int:
@@ -98,17 +165,21 @@ def _parse_period_to_seconds(period_str: str) -> int:
     # Add more units if needed (e.g., 'min' for minutes, 's' for seconds)
     raise ValueError(f"Unsupported period unit: {period_str}")
 
+def period_start_ms(period_str: str) -> int:
+    """Returns the start of the period ending now, as a millisecond timestamp."""
+    period_seconds = _parse_period_to_seconds(period_str)
+    end_ts = datetime.utcnow()
+    start_ts = end_ts - timedelta(seconds=period_seconds)
+    return int(start_ts.timestamp() * 1000)
+
 def get_volume_for_period(db: Session, timeframe: str, period_str: str, sort: str, limit: int, min_volume: float = 0, min_volume_target: str = "turnover") -> List[Any]:
     """
     指定された期間とタイムフレームに基づいて、各銘柄の合計出来高を取得します。
     """
     table_name = f"ohlcv_{timeframe}"
 
-    # Convert period string to seconds, then to milliseconds for timestamp comparison
-    period_seconds = _parse_period_to_seconds(period_str)
-    end_ts = datetime.utcnow()
-    start_ts = end_ts - timedelta(seconds=period_seconds)
-    start_ts_ms = int(start_ts.timestamp() * 1000)
+    # Convert period string to a millisecond timestamp for comparison
+    start_ts_ms = period_start_ms(period_str)
 
     # Sort order mapping
     sort_map = {
@@ -154,3 +225,149 @@ def get_volume_for_period(db: Session, timeframe: str, period_str: str, sort: st
         }
     )
     return result.fetchall()
+
+def get_gap_summary(db: Session) -> List[Any]:
+    """
+    fetcherが記録したタイムフレームごとの欠損区間の集計を取得します。
+    """
+    query = text("""
+        SELECT
+            timeframe,
+            gap_count,
+            missing_bars,
+            affected_symbols,
+            scanned_at
+        FROM ohlcv_gap_summary
+        ORDER BY timeframe ASC
+    """)
+    result = db.execute(query)
+    return result.fetchall()
+
+EXPORT_PAGE_SIZE = 5000
+
+def ohlcv_table_exists(db: Session, timeframe: str) -> bool:
+    """fetcherがそのタイムフレームのテーブルを作成しているかどうかを返します (TIMEFRAMESに含まれないタイムフレームは存在しません)。"""
+    query = text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name")
+    return db.execute(query, {"name": f"ohlcv_{timeframe}"}).first() is not None
+
+def iter_ohlcv_pages(db: Session, timeframe: str, symbols: List[str], start_ts: int, end_ts: int, page_size: int = EXPORT_PAGE_SIZE):
+    """
+    指定されたタイムフレームのOHLCVを (symbol, timestamp) のキーセットページングで読み出し、ページ単位で返すジェネレータです。
+    全件をメモリに載せないため、件数に関わらずメモリ使用量は page_size 分で一定です。
+    """
+    if symbols:
+        yield from _iter_symbol_pages(db, timeframe, symbols, start_ts, end_ts, page_size)
+        return
+
+    table_name = f"ohlcv_{timeframe}"
+    query = text(f"""
+        SELECT symbol, timestamp, open, high, low, close, volume, turnover
+        FROM {table_name}
+        WHERE
+            (symbol, timestamp) > (:last_symbol, :last_ts)
+            AND timestamp BETWEEN :start_ts AND :end_ts
+        ORDER BY symbol ASC, timestamp ASC
+        LIMIT :page_size
+    """)
+
+    # 空文字列はどの銘柄名よりも小さいため、最初のページは先頭から読み出される
+    params = {
+        "last_symbol": "",
+        "last_ts": 0,
+        "start_ts": start_ts,
+        "end_ts": end_ts,
+        "page_size": page_size,
+    }
+
+    while True:
+        rows = db.execute(query, params).fetchall()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < page_size:
+            return
+        params["last_symbol"] = rows[-1].symbol
+        params["last_ts"] = rows[-1].timestamp
+
+def _iter_symbol_pages(db: Session, timeframe: str, symbols: List[str], start_ts: int, end_ts: int, page_size: int):
+    """
+    銘柄を指定した場合は1銘柄ずつ timestamp でキーセットページングします。
+    `symbol IN (...)` と行値比較を組み合わせると、SQLiteは symbol = ? AND timestamp BETWEEN でインデックスを引き、
+    行値比較は読み出し後のフィルタになるため、ページごとに start から読み直してしまいます。
+    """
+    table_name = f"ohlcv_{timeframe}"
+    query = text(f"""
+        SELECT symbol, timestamp, open, high, low, close, volume, turnover
+        FROM {table_name}
+        WHERE
+            symbol = :symbol
+            AND timestamp > :last_ts
+            AND timestamp <= :end_ts
+        ORDER BY timestamp ASC
+        LIMIT :page_size
+    """)
+
+    for symbol in sorted(set(symbols)):
+        params = {"symbol": symbol, "last_ts": start_ts - 1, "end_ts": end_ts, "page_size": page_size}
+        while True:
+            rows = db.execute(query, params).fetchall()
+            if rows:
+                yield rows
+            if len(rows) < page_size:
+                break
+            params["last_ts"] = rows[-1].timestamp
+
+def get_ticker_ranking(db: Session, sort: str, limit: int, min_turnover: float = 0) -> List[Any]:
+    """
+    fetcherが毎サイクル保存している全銘柄のTickerスナップショットから、1時間/24時間の変動率と24時間売買代金のランキングを取得します。
+    Klineを使わないため、上位銘柄に限らず市場全体が対象です。
+    """
+    sort_map = {
+        "change_1h_desc": "change_1h_pct DESC",
+        "change_1h_asc": "change_1h_pct ASC",
+        "change_24h_desc": "change_24h_pct DESC",
+        "change_24h_asc": "change_24h_pct ASC",
+        "turnover_24h_desc": "turnover_24h DESC",
+        "symbol_asc": "symbol ASC",
+    }
+    order_by_clause = sort_map.get(sort, "change_24h_pct DESC")
+
+    query = text(f"""
+        SELECT
+            symbol,
+            last_price,
+            ((last_price - prev_price_1h) / prev_price_1h) * 100 AS change_1h_pct,
+            ((last_price - prev_price_24h) / prev_price_24h) * 100 AS change_24h_pct,
+            turnover_24h,
+            volume_24h,
+            updated_at
+        FROM ticker_snapshot
+        WHERE
+            prev_price_1h > 0
+            AND prev_price_24h > 0
+            AND turnover_24h >= :min_turnover
+        ORDER BY {order_by_clause}
+        LIMIT :limit
+    """)
+
+    result = db.execute(
+        query,
+        {
+            "min_turnover": min_turnover,
+            "limit": limit
+        }
+    )
+    return result.fetchall()
+
+def get_all_ohlcv(db: Session, timeframe: str) -> List[Any]:
+    """
+    テーブル全体を symbol昇順・timestamp降順 で取得します (スナップショットが無い場合のフォールバック用)。
+    """
+    table_name = f"ohlcv_{timeframe}"
+    query = text(f"""
+        SELECT symbol, timestamp, open, high, low, close, volume, turnover
+        FROM {table_name}
+        ORDER BY symbol ASC, timestamp DESC
+    """)
+    result = db.execute(query)
+    return result.fetchall()
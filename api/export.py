@@ -0,0 +1,77 @@
+import io
+import csv
+import json
+from typing import Any, Iterable, Iterator, List
+
+import pyarrow as pa
+
+EXPORT_COLUMNS = ["symbol", "timestamp", "open", "high", "low", "close", "volume", "turnover"]
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+ARROW_SCHEMA = pa.schema([
+    ("symbol", pa.string()),
+    ("timestamp", pa.int64()),
+    ("open", pa.float64()),
+    ("high", pa.float64()),
+    ("low", pa.float64()),
+    ("close", pa.float64()),
+    ("volume", pa.float64()),
+    ("turnover", pa.float64()),
+])
+
+def stream_ndjson(pages: Iterable[List[Any]]) -> Iterator[bytes]:
+    for rows in pages:
+        yield "".join(json.dumps(dict(zip(EXPORT_COLUMNS, row))) + "\n" for row in rows).encode()
+
+def stream_csv(pages: Iterable[List[Any]]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in pages:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+class _ChunkSink:
+    """pyarrowのストリームライターが書き込んだバイト列を、都度取り出せるようにためておく"""
+    closed = False
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+def stream_arrow(pages: Iterable[List[Any]]) -> Iterator[bytes]:
+    """Arrow IPC ストリーム形式で、1ページを1レコードバッチとして書き出す"""
+    sink = _ChunkSink()
+    writer = pa.ipc.new_stream(sink, ARROW_SCHEMA)
+    for rows in pages:
+        columns = list(zip(*rows))
+        writer.write_batch(pa.record_batch([pa.array(col, type=field.type) for col, field in zip(columns, ARROW_SCHEMA)], schema=ARROW_SCHEMA))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+STREAMERS = {
+    "ndjson": stream_ndjson,
+    "csv": stream_csv,
+    "arrow": stream_arrow,
+}
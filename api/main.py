@@ -1,14 +1,19 @@
 import os
-from fastapi import Depends, FastAPI, HTTPException, Query, Request
-from fastapi.responses import JSONResponse
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.exceptions import RequestValidationError
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from enum import Enum
 
 import crud
 import schemas
-from database import engine, get_db
+import snapshot
+import profiling
+import export
+import correlation
+from database import engine, get_db, SessionLocal
 
 app = FastAPI(
     title="CMMA API",
@@ -18,6 +23,9 @@ app = FastAPI(
     openapi_url="/volatility/openapi.json"
 )
 
+# PROFILING_ENABLED=true の場合のみ、プロファイル対象リクエストのSQL実行時間を計測する
+profiling.install_sql_timer(engine)
+
 # --- エラーハンドリング ---
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
@@ -56,6 +64,10 @@ class Direction(str, Enum):
     down = "down"
     both = "both"
 
+class VolatilityMode(str, Enum):
+    pct = "pct"
+    zscore = "zscore"
+
 class SortBy(str, Enum):
     volatility_desc = "volatility_desc"
     volatility_asc = "volatility_asc"
@@ -70,12 +82,14 @@ VALID_TIMEFRAMES = ["1m", "5m", "15m", "30m", "1h", "4h", "1d", "1w", "1M"]
     summary="価格変動率の高い銘柄を取得",
     response_description="条件に一致した銘柄の変動率データ"
 )
+@profiling.profiled("volatility")
 def read_volatility(
     timeframe: str = Query(..., description=f"タイムフレームを指定。有効値: {', '.join(VALID_TIMEFRAMES)}"),
-    price_threshold: float = Query(..., gt=0, description="価格変動率の閾値(%)。絶対値で比較されます。例: 5.0", alias="threshold"),
+    price_threshold: float = Query(..., gt=0, description="価格変動率の閾値(%)。絶対値で比較されます。例: 5.0。mode=zscoreの場合はzスコアの閾値。", alias="threshold"),
     offset: int = Query(1, gt=0, description="何本前のローソク足と比較するか。デフォルトは1 (1本前)。"),
     direction: Direction = Query(Direction.both, description="変動方向をフィルタ"),
-    sort: SortBy = Query(SortBy.volatility_desc, description="結果のソート順"),
+    sort: SortBy = Query(SortBy.volatility_desc, description="結果のソート順。mode=zscoreの場合、volatility_*はzスコアでソートします。"),
+    mode: VolatilityMode = Query(VolatilityMode.pct, description="pct: 価格変動率で評価。zscore: 銘柄自身の過去リターン分布に対するzスコアで評価。"),
     limit: int = Query(100, gt=0, le=500, description="取得する最大件数"),
     db: Session = Depends(get_db)
 ):
@@ -86,15 +100,36 @@ def read_volatility(
             headers={"X-Error-Code": "INVALID_TIMEFRAME"},
         )
     
-    results = crud.get_symbols_exceeding_threshold(
-        db=db, 
-        timeframe=timeframe, 
-        price_threshold=price_threshold,
-        offset=offset,
-        direction=direction.value,
-        sort=sort.value,
-        limit=limit
-    )
+    if mode == VolatilityMode.zscore:
+        results = crud.get_symbols_by_zscore(
+            db=db,
+            timeframe=timeframe,
+            z_threshold=price_threshold,
+            offset=offset,
+            direction=direction.value,
+            sort=sort.value,
+            limit=limit
+        )
+    else:
+        # fetcherが公開したスナップショットがあればmmapから計算し、なければDBに問い合わせる
+        results = snapshot.get_symbols_exceeding_threshold(
+            timeframe=timeframe,
+            price_threshold=price_threshold,
+            offset=offset,
+            direction=direction.value,
+            sort=sort.value,
+            limit=limit
+        )
+    if results is None:
+        results = crud.get_symbols_exceeding_threshold(
+            db=db, 
+            timeframe=timeframe, 
+            price_threshold=price_threshold,
+            offset=offset,
+            direction=direction.value,
+            sort=sort.value,
+            limit=limit
+        )
     
     # crudからの結果をレスポンスモデルに変換
     volatility_data = [
@@ -108,7 +143,8 @@ def read_volatility(
             ),
             change=schemas.ChangeInfo(
                 pct=round(row.volatility_pct, 4),
-                direction="up" if row.volatility_pct > 0 else "down"
+                direction="up" if row.volatility_pct > 0 else "down",
+                zscore=round(row.zscore, 4) if mode == VolatilityMode.zscore else None
             )
         ) for row in results
     ]
@@ -175,6 +211,7 @@ def _parse_period_to_minutes(period_str: str) -> int:
     summary="指定期間の出来高ランキングを取得",
     response_description="条件に一致した銘柄の合計出来高データ"
 )
+@profiling.profiled("volume")
 def read_volume(
     timeframe: str = Query(..., description=f"出来高集計に使うOHLCVのタイムフレーム。有効値: {', '.join(VALID_TIMEFRAMES)}"),
     period: str = Query(..., description=f"出来高を集計する期間 (例: '24h', '7d')。有効値: {', '.join(VALID_PERIODS)}"),
@@ -219,15 +256,24 @@ def read_volume(
             headers={"X-Error-Code": "INSUFFICIENT_HISTORY"}
         )
 
-    results = crud.get_volume_for_period(
-        db=db,
+    results = snapshot.get_volume_for_period(
         timeframe=timeframe,
-        period_str=period,
+        start_ts_ms=crud.period_start_ms(period),
         sort=sort.value,
         limit=limit,
         min_volume=min_volume or 0,
         min_volume_target=min_volume_target.value,
     )
+    if results is None:
+        results = crud.get_volume_for_period(
+            db=db,
+            timeframe=timeframe,
+            period_str=period,
+            sort=sort.value,
+            limit=limit,
+            min_volume=min_volume or 0,
+            min_volume_target=min_volume_target.value,
+        )
 
     volume_data = [
         schemas.VolumeData(
@@ -240,3 +286,188 @@ def read_volume(
     ]
 
     return schemas.VolumeResponse(count=len(volume_data), data=volume_data)
+
+@app.get(
+    "/gaps",
+    response_model=schemas.GapSummaryResponse,
+    summary="タイムフレームごとの欠損区間の集計を取得",
+    response_description="fetcherが検出した欠損区間の件数と欠損本数"
+)
+def read_gaps(db: Session = Depends(get_db)):
+    results = crud.get_gap_summary(db)
+
+    gap_data = [
+        schemas.GapSummaryData(
+            timeframe=row.timeframe,
+            gap_count=row.gap_count,
+            missing_bars=row.missing_bars,
+            affected_symbols=row.affected_symbols,
+            scanned_at=row.scanned_at
+        ) for row in results
+    ]
+
+    return schemas.GapSummaryResponse(count=len(gap_data), data=gap_data)
+
+class TickerSortBy(str, Enum):
+    change_1h_desc = "change_1h_desc"
+    change_1h_asc = "change_1h_asc"
+    change_24h_desc = "change_24h_desc"
+    change_24h_asc = "change_24h_asc"
+    turnover_24h_desc = "turnover_24h_desc"
+    symbol_asc = "symbol_asc"
+
+@app.get(
+    "/tickers",
+    response_model=schemas.TickerResponse,
+    summary="全銘柄の1時間/24時間変動率・24時間売買代金ランキングを取得",
+    response_description="Tickerスナップショットに基づく銘柄データ"
+)
+def read_tickers(
+    sort: TickerSortBy = Query(TickerSortBy.change_24h_desc, description="結果のソート順"),
+    min_turnover: float = Query(None, gt=0, description="24時間売買代金での足切り。例: 10000000 (10M)"),
+    limit: int = Query(100, gt=0, le=1000, description="取得する最大件数"),
+    db: Session = Depends(get_db)
+):
+    results = crud.get_ticker_ranking(
+        db=db,
+        sort=sort.value,
+        limit=limit,
+        min_turnover=min_turnover or 0,
+    )
+
+    ticker_data = [
+        schemas.TickerData(
+            symbol=row.symbol,
+            last_price=row.last_price,
+            change_1h_pct=round(row.change_1h_pct, 4),
+            change_24h_pct=round(row.change_24h_pct, 4),
+            turnover_24h=round(row.turnover_24h, 4),
+            volume_24h=round(row.volume_24h, 4),
+            updated_at=row.updated_at
+        ) for row in results
+    ]
+
+    return schemas.TickerResponse(count=len(ticker_data), data=ticker_data)
+
+@app.get(
+    "/correlation",
+    response_model=schemas.CorrelationResponse,
+    summary="銘柄間のリターン相関行列と基準銘柄に対するベータを取得",
+    response_description="基準銘柄に対するベータ・相関と、相関行列"
+)
+def read_correlation(
+    timeframe: str = Query(..., description=f"タイムフレームを指定。有効値: {', '.join(VALID_TIMEFRAMES)}"),
+    window: int = Query(100, ge=2, description="計算に用いるリターンの本数"),
+    reference: str = Query("BTCUSDT", description="ベータの基準銘柄"),
+    symbols: Optional[str] = Query(None, description="カンマ区切りの銘柄シンボル。省略時は全銘柄。"),
+    include_matrix: bool = Query(True, description="相関行列を含めるかどうか"),
+    db: Session = Depends(get_db)
+):
+    if timeframe not in VALID_TIMEFRAMES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"無効なタイムフレームです。有効な値: {', '.join(VALID_TIMEFRAMES)}",
+            headers={"X-Error-Code": "INVALID_TIMEFRAME"},
+        )
+    if window + 1 > OHLCV_HISTORY_LIMIT:
+        raise HTTPException(
+            status_code=400,
+            detail=f"window={window} には{window + 1}本のローソク足が必要です。これは現在利用可能な履歴の最大本数"
+                   f"({OHLCV_HISTORY_LIMIT}本) を超えています。",
+            headers={"X-Error-Code": "INSUFFICIENT_HISTORY"}
+        )
+
+    reference = reference.strip().upper()
+    symbol_list = [s.strip().upper() for s in symbols.split(",") if s.strip()] if symbols else None
+
+    # スナップショットの版ごとに結果をキャッシュする。無い場合はDBから同じ形式のデータを組み立てる
+    snap = snapshot.load_snapshot(timeframe)
+    if snap is None:
+        snap = snapshot.build_snapshot(crud.get_all_ohlcv(db, timeframe))
+
+    try:
+        body = correlation.get_correlation(snap, timeframe, window, reference, symbol_list, include_matrix)
+    except correlation.ReferenceNotAvailableError:
+        raise HTTPException(
+            status_code=404,
+            detail=f"基準銘柄 {reference} の直近{window + 1}本のローソク足がありません。",
+            headers={"X-Error-Code": "REFERENCE_NOT_AVAILABLE"},
+        )
+
+    # 500銘柄の相関行列は直列化の負荷が大きいため、キャッシュ済みのJSONをそのまま返す
+    return Response(content=body, media_type="application/json")
+
+class ExportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+    arrow = "arrow"
+
+@app.get(
+    "/export",
+    response_class=StreamingResponse,
+    summary="OHLCVをストリーミングでエクスポート",
+    response_description="指定条件に一致したローソク足 (symbol, timestamp の昇順)"
+)
+def export_ohlcv(
+    timeframe: str = Query(..., description=f"タイムフレームを指定。有効値: {', '.join(VALID_TIMEFRAMES)}"),
+    symbols: Optional[str] = Query(None, description="カンマ区切りの銘柄シンボル。省略時は全銘柄。例: BTCUSDT,ETHUSDT"),
+    start: int = Query(0, ge=0, description="開始タイムスタンプ (ミリ秒, この値を含む)"),
+    end: Optional[int] = Query(None, ge=0, description="終了タイムスタンプ (ミリ秒, この値を含む)。省略時は最新まで。"),
+    export_format: ExportFormat = Query(ExportFormat.ndjson, alias="format", description="出力形式 (ndjson, csv, arrow)"),
+):
+    if timeframe not in VALID_TIMEFRAMES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"無効なタイムフレームです。有効な値: {', '.join(VALID_TIMEFRAMES)}",
+            headers={"X-Error-Code": "INVALID_TIMEFRAME"},
+        )
+    if end is not None and end < start:
+        raise HTTPException(
+            status_code=400,
+            detail="endはstart以上の値を指定してください。",
+            headers={"X-Error-Code": "INVALID_RANGE"},
+        )
+
+    symbol_list = [s.strip().upper() for s in symbols.split(",") if s.strip()] if symbols else []
+    end_ts = end if end is not None else 2**63 - 1
+
+    # レスポンスの送信が終わるまで接続を保持する必要があるため、依存性注入ではなくジェネレータ内でセッションを閉じる。
+    # ステータスを返した後ではエラーを伝えられないため、テーブルの確認と最初のページの読み出しはここで行う
+    db = SessionLocal()
+    try:
+        if not crud.ohlcv_table_exists(db, timeframe):
+            raise HTTPException(
+                status_code=404,
+                detail=f"タイムフレーム {timeframe} のデータは収集されていません (fetcherのTIMEFRAMESを確認してください)。",
+                headers={"X-Error-Code": "TIMEFRAME_NOT_AVAILABLE"},
+            )
+        page_iter = crud.iter_ohlcv_pages(db, timeframe, symbol_list, start, end_ts)
+        first_page = next(page_iter, None)
+    except SQLAlchemyError as e:
+        db.close()
+        raise HTTPException(
+            status_code=500,
+            detail=f"OHLCVの読み出しに失敗しました: {e.__class__.__name__}",
+            headers={"X-Error-Code": "DATABASE_ERROR"},
+        )
+    except HTTPException:
+        db.close()
+        raise
+
+    def pages():
+        try:
+            if first_page is not None:
+                yield first_page
+                yield from page_iter
+        finally:
+            db.close()
+
+    return StreamingResponse(
+        export.STREAMERS[export_format.value](pages()),
+        media_type=export.MEDIA_TYPES[export_format.value],
+        headers={
+            "Content-Disposition": f'attachment; filename="ohlcv_{timeframe}.{export_format.value}"',
+            # nginxでバッファリングせず、そのままクライアントへ流す
+            "X-Accel-Buffering": "no",
+        },
+    )
@@ -0,0 +1,118 @@
+import os
+import io
+import time
+import inspect
+import functools
+import pstats
+import cProfile
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from fastapi import Request, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger("uvicorn.error")
+
+# 無効時はリクエストごとにこのフラグを見るだけで、SQLのイベントフックも登録しない
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILE_DIR = Path("./logs/profiles/api")
+PROFILE_MAX_TOTAL_MB = int(os.getenv("PROFILE_MAX_TOTAL_MB", "50"))
+
+# プロファイル中のリクエストだけ [SQL実行時間(秒), クエリ数] を集計する
+_sql_timing: ContextVar[Optional[List[float]]] = ContextVar("sql_timing", default=None)
+
+def install_sql_timer(engine: Engine):
+    """プロファイル対象リクエストのSQL実行時間を計測するイベントフックを登録する"""
+    if not PROFILING_ENABLED:
+        return
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if _sql_timing.get() is not None:
+            conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        timing = _sql_timing.get()
+        if timing is not None and conn.info.get("query_start"):
+            timing[0] += time.perf_counter() - conn.info["query_start"].pop()
+            timing[1] += 1
+
+def _is_requested(request: Request) -> bool:
+    return request.headers.get("X-Profile") == "1" or request.query_params.get("profile") == "1"
+
+def _enforce_size_limit(directory: Path, max_bytes: int):
+    """ディレクトリの合計サイズが上限を超えたら古いファイルから削除する"""
+    files = sorted((p for p in directory.iterdir() if p.is_file()), key=lambda p: p.stat().st_mtime)
+    total = sum(p.stat().st_size for p in files)
+    for path in files:
+        if total <= max_bytes:
+            break
+        total -= path.stat().st_size
+        path.unlink(missing_ok=True)
+
+@contextmanager
+def profile_request(name: str, request: Request, response: Response):
+    """
+    PROFILING_ENABLED=true かつ `X-Profile: 1` ヘッダまたは `profile=1` クエリが指定されたリクエストだけを
+    cProfileで計測し、SQL実行時間とあわせて PROFILE_DIR に書き出す。
+    """
+    if not PROFILING_ENABLED or not _is_requested(request):
+        yield
+        return
+
+    timing = [0.0, 0]
+    token = _sql_timing.set(timing)
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        wall_seconds = time.perf_counter() - started
+        _sql_timing.reset(token)
+
+        try:
+            PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+            base = PROFILE_DIR / f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{time.time_ns() % 1_000_000_000}"
+            profiler.dump_stats(f"{base}.prof")
+
+            summary = io.StringIO()
+            summary.write(f"endpoint: {name}\nquery: {request.url.query}\n")
+            summary.write(f"wall_ms: {wall_seconds * 1000:.2f}\nsql_ms: {timing[0] * 1000:.2f}\nsql_queries: {timing[1]}\n\n")
+            pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(30)
+            Path(f"{base}.txt").write_text(summary.getvalue(), encoding="utf-8")
+
+            _enforce_size_limit(PROFILE_DIR, PROFILE_MAX_TOTAL_MB * 1024 * 1024)
+            response.headers["X-Profile-File"] = Path(f"{base}.prof").name
+        except OSError as e:
+            logger.warning(f"プロファイルの書き出しに失敗: {e}")
+
+        response.headers["X-Profile-Wall-Ms"] = f"{wall_seconds * 1000:.2f}"
+        response.headers["X-Profile-Sql-Ms"] = f"{timing[0] * 1000:.2f}"
+
+def profiled(name: str) -> Callable:
+    """
+    同期エンドポイントを profile_request で囲むデコレータ。エンドポイント本体と同じスレッドで計測する。
+    計測に使うRequest/Responseは、FastAPIに渡すシグネチャにキーワード専用引数として追加して受け取る。
+    """
+    def decorator(func: Callable) -> Callable:
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, _profile_request: Request, _profile_response: Response, **kwargs):
+            with profile_request(name, _profile_request, _profile_response):
+                return func(*args, **kwargs)
+
+        wrapper.__signature__ = signature.replace(parameters=[
+            *signature.parameters.values(),
+            inspect.Parameter("_profile_request", inspect.Parameter.KEYWORD_ONLY, annotation=Request),
+            inspect.Parameter("_profile_response", inspect.Parameter.KEYWORD_ONLY, annotation=Response),
+        ])
+        return wrapper
+    return decorator
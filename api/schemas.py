@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List
+from typing import List, Optional
 
 class PriceInfo(BaseModel):
     """価格情報"""
@@ -10,6 +10,7 @@ class ChangeInfo(BaseModel):
     """変動情報"""
     pct: float = Field(..., description="価格変動率 (%)")
     direction: str = Field(..., description="変動方向 ('up' または 'down')")
+    zscore: Optional[float] = Field(None, description="銘柄自身の過去リターン分布に対するzスコア (mode=zscore の場合のみ)")
 
 class VolatilityData(BaseModel):
     """変動率データ本体"""
@@ -49,3 +50,55 @@ class VolumeResponse(BaseModel):
     """出来高APIレスポンス全体"""
     count: int = Field(..., description="返されたデータ件数")
     data: List[VolumeData]
+
+class GapSummaryData(BaseModel):
+    """欠損区間の集計"""
+    timeframe: str = Field(..., description="タイムフレーム")
+    gap_count: int = Field(..., description="検出された欠損区間の数")
+    missing_bars: int = Field(..., description="欠損しているローソク足の合計本数")
+    affected_symbols: int = Field(..., description="欠損区間を含む銘柄数")
+    scanned_at: int = Field(..., description="最後に走査した時刻 (UNIX秒)")
+
+    class Config:
+        from_attributes = True
+
+class GapSummaryResponse(BaseModel):
+    """欠損区間APIレスポンス全体"""
+    count: int = Field(..., description="返されたデータ件数")
+    data: List[GapSummaryData]
+
+class TickerData(BaseModel):
+    """Tickerスナップショット由来の変動率・売買代金"""
+    symbol: str = Field(..., description="銘柄シンボル")
+    last_price: float = Field(..., description="最終取引価格")
+    change_1h_pct: float = Field(..., description="1時間前の価格からの変動率 (%)")
+    change_24h_pct: float = Field(..., description="24時間前の価格からの変動率 (%)")
+    turnover_24h: float = Field(..., description="24時間の売買代金 (見積もり通貨, 例: USDT)")
+    volume_24h: float = Field(..., description="24時間の出来高 (基準通貨, 例: BTC)")
+    updated_at: int = Field(..., description="fetcherがスナップショットを保存した時刻 (ミリ秒)")
+
+    class Config:
+        from_attributes = True
+
+class TickerResponse(BaseModel):
+    """TickerランキングAPIレスポンス全体"""
+    count: int = Field(..., description="返されたデータ件数")
+    data: List[TickerData]
+
+class BetaData(BaseModel):
+    """基準銘柄に対するベータと相関"""
+    symbol: str = Field(..., description="銘柄シンボル")
+    beta: float = Field(..., description="基準銘柄のリターンに対するベータ")
+    correlation: float = Field(..., description="基準銘柄とのリターンの相関係数")
+
+class CorrelationResponse(BaseModel):
+    """相関・ベータAPIレスポンス全体"""
+    timeframe: str = Field(..., description="タイムフレーム")
+    window: int = Field(..., description="計算に用いたリターンの本数")
+    reference: str = Field(..., description="ベータの基準銘柄")
+    candle_ts: int = Field(..., description="計算に用いた最新のローソク足の開始タイムスタンプ (ミリ秒)")
+    count: int = Field(..., description="返されたデータ件数")
+    data: List[BetaData]
+    symbols: List[str] = Field(..., description="相関行列の行・列に対応する銘柄")
+    matrix: Optional[List[List[float]]] = Field(None, description="リターンの相関行列 (include_matrix=true の場合)")
+    excluded: List[str] = Field(..., description="足が揃わない、または価格変動がないため除外した銘柄")
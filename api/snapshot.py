@@ -0,0 +1,183 @@
+import os
+import time
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+logger = logging.getLogger("uvicorn.error")
+
+# fetcherが公開するスナップショットの置き場所 (DATABASE_URLと同じくコンテナ内の相対パス)
+SNAPSHOT_DIR = Path("./data/snapshots")
+SNAPSHOT_ENABLED = os.getenv("SNAPSHOT_ENABLED", "true").lower() == "true"
+# fetcherは毎サイクル公開するため、公開間隔は最大でも FETCH_INTERVAL_SECONDS + サイクルの所要時間。
+# これより古いスナップショットは公開が止まっている (失敗している、またはfetcher側で無効) とみなしDBを使う。0で無効。
+SNAPSHOT_MAX_AGE_SECONDS = float(os.getenv("SNAPSHOT_MAX_AGE_SECONDS", str(3 * int(os.getenv("FETCH_INTERVAL_SECONDS", "300")))))
+
+# fetcher/snapshot.py と同じレイアウトであること
+SNAPSHOT_DTYPE = np.dtype([
+    ("symbol", "S32"),
+    ("timestamp", "<i8"),
+    ("open", "<f8"),
+    ("high", "<f8"),
+    ("low", "<f8"),
+    ("close", "<f8"),
+    ("volume", "<f8"),
+    ("turnover", "<f8"),
+])
+
+class VolatilityRow(NamedTuple):
+    symbol: str
+    timeframe: str
+    candle_ts: int
+    close: float
+    prev_close: float
+    volatility_pct: float
+
+class VolumeRow(NamedTuple):
+    symbol: str
+    total_volume: float
+    total_turnover: float
+
+class _LoadedSnapshot:
+    """mmapしたスナップショットと、銘柄ごとのグループ境界 (symbol昇順・timestamp降順で並んでいる前提)"""
+    def __init__(self, identity: tuple, array: np.ndarray):
+        self.identity = identity
+        self.array = array
+        symbols = np.asarray(array["symbol"])
+        if len(symbols):
+            boundary = np.empty(len(symbols), dtype=bool)
+            boundary[0] = True
+            np.not_equal(symbols[1:], symbols[:-1], out=boundary[1:])
+            self.starts = np.flatnonzero(boundary)
+        else:
+            self.starts = np.empty(0, dtype=np.int64)
+        self.counts = np.diff(np.append(self.starts, len(symbols)))
+        self.symbols = [s.decode() for s in symbols[self.starts]]
+        self.group_ids = np.repeat(np.arange(len(self.starts)), self.counts)
+
+_cache: Dict[str, _LoadedSnapshot] = {}
+_cache_lock = threading.Lock()
+# 古いと判定したスナップショット (timeframe -> identity)。同じファイルについて警告を繰り返さない
+_stale_warned: Dict[str, tuple] = {}
+
+def load_snapshot(timeframe: str) -> Optional[_LoadedSnapshot]:
+    """
+    タイムフレームのスナップショットを返す。ファイルが置き換えられていれば再度mmapする。
+    利用できない場合やSNAPSHOT_MAX_AGE_SECONDSより古い場合はNoneを返し、呼び出し側はDBクエリにフォールバックする。
+    """
+    if not SNAPSHOT_ENABLED:
+        return None
+    path = SNAPSHOT_DIR / f"ohlcv_{timeframe}.npy"
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    identity = (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    age = time.time() - st.st_mtime
+    if SNAPSHOT_MAX_AGE_SECONDS > 0 and age > SNAPSHOT_MAX_AGE_SECONDS:
+        if _stale_warned.get(timeframe) != identity:
+            _stale_warned[timeframe] = identity
+            logger.warning(f"スナップショットが{age:.0f}秒間更新されていないため、DBにフォールバックします: {path}")
+        return None
+
+    with _cache_lock:
+        cached = _cache.get(timeframe)
+        if cached and cached.identity == identity:
+            return cached
+        try:
+            array = np.load(path, mmap_mode="r")
+        except (OSError, ValueError) as e:
+            logger.warning(f"スナップショットの読み込みに失敗: {path}: {e}")
+            return None
+        if array.dtype != SNAPSHOT_DTYPE:
+            logger.warning(f"スナップショットのレイアウトが不正です: {path}")
+            return None
+        loaded = _LoadedSnapshot(identity, array)
+        _cache[timeframe] = loaded
+        return loaded
+
+def build_snapshot(rows: List[Any]) -> _LoadedSnapshot:
+    """DBから symbol昇順・timestamp降順 で読み出した行から、スナップショットと同じ形式のデータを作る"""
+    return _LoadedSnapshot(None, np.array([tuple(row) for row in rows], dtype=SNAPSHOT_DTYPE))
+
+def get_symbols_exceeding_threshold(timeframe: str, price_threshold: float, offset: int, direction: str, sort: str, limit: int) -> Optional[List[VolatilityRow]]:
+    """crud.get_symbols_exceeding_threshold と同じ結果をスナップショットから計算する"""
+    snap = load_snapshot(timeframe)
+    if snap is None:
+        return None
+
+    groups = np.flatnonzero(snap.counts > offset)
+    latest_idx = snap.starts[groups]
+    prev_idx = latest_idx + offset
+
+    close = snap.array["close"][latest_idx]
+    prev_close = snap.array["close"][prev_idx]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pct = (close - prev_close) / prev_close * 100
+
+    mask = (prev_close != 0) & (np.abs(pct) >= price_threshold)
+    if direction == "up":
+        mask &= pct > 0
+    elif direction == "down":
+        mask &= pct < 0
+    selected = np.flatnonzero(mask)
+
+    if sort == "volatility_asc":
+        selected = selected[np.argsort(pct[selected], kind="stable")]
+    elif sort != "symbol_asc":
+        selected = selected[np.argsort(-pct[selected], kind="stable")]
+    selected = selected[:limit]
+
+    timestamps = snap.array["timestamp"][latest_idx[selected]]
+    return [
+        VolatilityRow(
+            symbol=snap.symbols[groups[i]],
+            timeframe=timeframe,
+            candle_ts=int(ts),
+            close=float(close[i]),
+            prev_close=float(prev_close[i]),
+            volatility_pct=float(pct[i]),
+        ) for i, ts in zip(selected, timestamps)
+    ]
+
+def get_volume_for_period(timeframe: str, start_ts_ms: int, sort: str, limit: int, min_volume: float = 0, min_volume_target: str = "turnover") -> Optional[List[VolumeRow]]:
+    """crud.get_volume_for_period と同じ結果をスナップショットから計算する"""
+    snap = load_snapshot(timeframe)
+    if snap is None:
+        return None
+
+    in_period = snap.array["timestamp"] >= start_ts_ms
+    group_ids = snap.group_ids[in_period]
+    n_groups = len(snap.starts)
+    total_volume = np.bincount(group_ids, weights=snap.array["volume"][in_period], minlength=n_groups)
+    total_turnover = np.bincount(group_ids, weights=snap.array["turnover"][in_period], minlength=n_groups)
+
+    mask = np.bincount(group_ids, minlength=n_groups) > 0
+    if min_volume > 0:
+        target = total_volume if min_volume_target == "volume" else total_turnover
+        mask &= target > min_volume
+    selected = np.flatnonzero(mask)
+
+    sort_keys = {
+        "volume_desc": -total_volume,
+        "volume_asc": total_volume,
+        "turnover_desc": -total_turnover,
+        "turnover_asc": total_turnover,
+    }
+    if sort in sort_keys:
+        selected = selected[np.argsort(sort_keys[sort][selected], kind="stable")]
+    elif sort != "symbol_asc":
+        selected = selected[np.argsort(-total_volume[selected], kind="stable")]
+    selected = selected[:limit]
+
+    return [
+        VolumeRow(
+            symbol=snap.symbols[g],
+            total_volume=float(total_volume[g]),
+            total_turnover=float(total_turnover[g]),
+        ) for g in selected
+    ]
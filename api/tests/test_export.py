@@ -0,0 +1,96 @@
+import csv
+import io
+import sqlite3
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import crud
+import main
+
+HOUR_MS = 3_600_000
+PAGE_SIZE = 1000
+
+@pytest.fixture
+def session_factory(tmp_path):
+    db_file = tmp_path / "cmma.db"
+    conn = sqlite3.connect(db_file)
+    conn.execute("""
+        CREATE TABLE ohlcv_1h (
+            symbol TEXT NOT NULL, timestamp INTEGER NOT NULL,
+            open REAL NOT NULL, high REAL NOT NULL, low REAL NOT NULL, close REAL NOT NULL,
+            volume REAL NOT NULL, turnover REAL NOT NULL,
+            PRIMARY KEY (symbol, timestamp)
+        )
+    """)
+    counts = {"AUSDT": 500, "BTCUSDT": 20 * PAGE_SIZE, "CUSDT": 500}
+    conn.executemany(
+        "INSERT INTO ohlcv_1h VALUES (?, ?, 1, 1, 1, 1, 1, 1)",
+        ((symbol, i * HOUR_MS) for symbol, n in counts.items() for i in range(n)),
+    )
+    conn.commit()
+    conn.close()
+    engine = create_engine(f"sqlite:///{db_file}", connect_args={"check_same_thread": False})
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+def _page_costs(db, pages):
+    """ページごとに実行されたSQLiteのVM命令数 (100命令単位) を数える"""
+    raw = db.connection().connection.driver_connection
+    steps = [0]
+
+    def count():
+        steps[0] += 1
+        return 0
+
+    raw.set_progress_handler(count, 100)
+    costs = []
+    for _ in pages:
+        costs.append(steps[0])
+        steps[0] = 0
+    return costs
+
+@pytest.mark.parametrize("symbols", [[], ["BTCUSDT"]])
+def test_page_cost_does_not_grow(session_factory, symbols):
+    db = session_factory()
+    pages = crud.iter_ohlcv_pages(db, "1h", symbols, 0, 2**63 - 1, page_size=PAGE_SIZE)
+    first = next(pages)
+    assert len(first) == PAGE_SIZE
+    costs = _page_costs(db, pages)
+    db.close()
+
+    assert len(costs) >= 19
+    # 後半のページでも読み出し量は先頭のページと同程度 (startから読み直していない)
+    assert max(costs[-5:]) <= 2 * max(costs[:5]) + 5
+
+def test_symbol_filter_respects_range_and_order(session_factory):
+    db = session_factory()
+    start, end = 100 * HOUR_MS, 2500 * HOUR_MS
+    rows = [
+        (row.symbol, row.timestamp)
+        for page in crud.iter_ohlcv_pages(db, "1h", ["CUSDT", "BTCUSDT", "CUSDT"], start, end, page_size=PAGE_SIZE)
+        for row in page
+    ]
+    db.close()
+
+    expected = [("BTCUSDT", i * HOUR_MS) for i in range(100, 2501)] + [("CUSDT", i * HOUR_MS) for i in range(100, 500)]
+    assert rows == expected
+
+@pytest.fixture
+def client(session_factory, monkeypatch):
+    monkeypatch.setattr(main, "SessionLocal", session_factory)
+    return TestClient(main.app)
+
+def test_export_streams_all_rows(client):
+    response = client.get("/export", params={"timeframe": "1h", "symbols": "AUSDT,CUSDT", "format": "csv"})
+    assert response.status_code == 200
+    rows = list(csv.reader(io.StringIO(response.text)))
+    assert rows[0] == ["symbol", "timestamp", "open", "high", "low", "close", "volume", "turnover"]
+    assert len(rows) == 1 + 1000
+
+def test_export_of_uncollected_timeframe_is_an_error(client):
+    response = client.get("/export", params={"timeframe": "1w", "format": "csv"})
+    assert response.status_code == 404
+    assert response.json()["error"]["code"] == "TIMEFRAME_NOT_AVAILABLE"
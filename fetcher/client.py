@@ -1,13 +1,84 @@
 import aiohttp
 import asyncio
 import logging
+import time
+from collections import deque
 from typing import List, Any, Optional
 
+class BybitAPIError(Exception):
+    """retCodeが0以外のレスポンス"""
+
+class RequestSkipped(Exception):
+    """サーキットブレーカーが開いている、または期限切れのためリクエストを送らなかった"""
+
+class LatencyTracker:
+    """直近のレスポンス時間を保持し、ヘッジ(投機的再送)を出す目安のp95を返す"""
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def p95(self) -> Optional[float]:
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+class CircuitBreaker:
+    """
+    連続でfailure_threshold回失敗したらcooldown_seconds秒はリクエストを送らない。
+    クールダウン後は1件だけ試行し、成功すれば復帰、失敗すれば再びクールダウンする。
+    """
+    def __init__(self, name: str, failure_threshold: int, cooldown_seconds: float, logger: logging.Logger):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.logger = logger
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.probe_in_flight = False
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if time.monotonic() - self.opened_at < self.cooldown_seconds or self.probe_in_flight:
+            return False
+        self.probe_in_flight = True
+        return True
+
+    def record_success(self):
+        if self.opened_at is not None:
+            self.logger.info(f"サーキットブレーカー({self.name}) を閉じました。リクエストを再開します。")
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+
+    def record_ignored(self):
+        """取引所の障害とはみなさない失敗。試行中の1件だった場合は、次の試行を許可する"""
+        self.probe_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.probe_in_flight or (self.opened_at is None and self.consecutive_failures >= self.failure_threshold):
+            self.logger.warning(f"サーキットブレーカー({self.name}) を開きました。{self.cooldown_seconds}秒間リクエストを停止します。")
+            self.opened_at = time.monotonic()
+            self.probe_in_flight = False
+
 class BybitClient:
-    def __init__(self, base_url: str, logger: logging.Logger):
+    def __init__(self, base_url: str, logger: logging.Logger, request_timeout: float = 10, hedge_enabled: bool = True,
+                 hedge_max_ratio: float = 0.1, breaker_failure_threshold: int = 5, breaker_cooldown_seconds: float = 30):
         self.base_url = base_url
         self.logger = logger
-        self.timeout = aiohttp.ClientTimeout(total=10)
+        self.request_timeout = request_timeout
+        self.timeout = aiohttp.ClientTimeout(total=request_timeout)
+        self.hedge_enabled = hedge_enabled
+        # レートリミットを圧迫しないよう、ヘッジはリクエスト数のこの割合までに抑える
+        self.hedge_max_ratio = hedge_max_ratio
+        self.kline_latency = LatencyTracker()
+        self.kline_breaker = CircuitBreaker("kline", breaker_failure_threshold, breaker_cooldown_seconds, logger)
+        self.counters = {"requests": 0, "hedged": 0, "deadline_skipped": 0, "breaker_skipped": 0}
 
     async def get_all_linear_symbols(self, session: aiohttp.ClientSession) -> List[str]:
         url = f"{self.base_url}/v5/market/instruments-info"
@@ -69,18 +140,116 @@ class BybitClient:
         self.logger.info(f"合計 {len(tickers)} のTicker情報を取得")
         return tickers
 
-    async def get_kline_data(self, session: aiohttp.ClientSession, symbol: str, interval: str, limit: int = 5) -> Optional[List[List[Any]]]:
+    async def _request_kline(self, session: aiohttp.ClientSession, params: dict) -> List[List[Any]]:
+        async with session.get(f"{self.base_url}/v5/market/kline", params=params) as response:
+            response.raise_for_status()
+            data = await response.json()
+            if data.get("retCode") != 0:
+                raise BybitAPIError(data.get("retMsg"))
+            return [[int(i[0]), float(i[1]), float(i[2]), float(i[3]), float(i[4]), float(i[5]), float(i[6])] for i in data.get("result", {}).get("list", [])]
+
+    async def _hedged_request(self, make_request, timeout: float, tracker: LatencyTracker):
+        """
+        リクエストを送り、観測済みのp95を過ぎても応答がなければ同じリクエストをもう1本送って、先に成功した方を採用する。
+        timeout秒以内に成功しなければasyncio.TimeoutErrorを、全て失敗すれば最後の例外を送出する。
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = started + timeout
+
+        def start_request() -> asyncio.Future:
+            # 採用されなかった方や、待ち切れずに終わった方の例外も読み捨てて
+            # "Task exception was never retrieved" を出さないようにする
+            task = asyncio.ensure_future(make_request())
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            return task
+
+        pending = {start_request()}
+        last_error: Optional[BaseException] = None
+        try:
+            hedge_delay = tracker.p95() if self.hedge_enabled else None
+            if hedge_delay is not None and hedge_delay < timeout:
+                done, pending = await asyncio.wait(pending, timeout=hedge_delay)
+                pending |= done
+                if not done and self.counters["hedged"] < self.hedge_max_ratio * self.counters["requests"]:
+                    self.counters["hedged"] += 1
+                    pending.add(start_request())
+
+            while pending:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                errors = [task.exception() for task in done]
+                for task, error in zip(done, errors):
+                    if error is None:
+                        tracker.record(loop.time() - started)
+                        return task.result()
+                    last_error = error
+
+            if last_error is not None and not pending:
+                raise last_error
+            raise asyncio.TimeoutError()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def get_kline_data(self, session: aiohttp.ClientSession, symbol: str, interval: str, limit: int = 5, start: Optional[int] = None, end: Optional[int] = None, deadline: Optional[float] = None) -> Optional[List[List[Any]]]:
+        """
+        deadlineはイベントループ時刻(loop.time())での期限。指定された場合、タイムアウトは残り時間に切り詰められる。
+        サーキットブレーカーが開いている間や期限切れの場合は、リクエストを送らずにRequestSkippedを送出する。
+        リクエストを送って失敗した場合はNoneを返す。
+        """
         params = {"category": "linear", "symbol": symbol, "interval": interval, "limit": limit}
+        # 欠損区間の補修用に、取得範囲(ミリ秒)を指定できる
+        if start is not None:
+            params["start"] = start
+        if end is not None:
+            params["end"] = end
+
+        timeout = self.request_timeout
+        if deadline is not None:
+            timeout = min(timeout, deadline - asyncio.get_running_loop().time())
+            if timeout <= 0:
+                self.counters["deadline_skipped"] += 1
+                raise RequestSkipped("deadline")
+
+        if not self.kline_breaker.allow():
+            self.counters["breaker_skipped"] += 1
+            raise RequestSkipped("circuit breaker")
+
+        self.counters["requests"] += 1
+        # ブレーカーには取引所側の障害だけを数える。自分で切り詰めた期限によるタイムアウトや、
+        # 4xx・パースエラーで開くと、健全な取引所へのリクエストまで止めてしまう
+        upstream_failure = False
         try:
-            async with session.get(f"{self.base_url}/v5/market/kline", params=params) as response:
-                response.raise_for_status()
-                data = await response.json()
-                if data.get("retCode") == 0:
-                    result_list = [[int(i[0]), float(i[1]), float(i[2]), float(i[3]), float(i[4]), float(i[5]), float(i[6])] for i in data.get("result", {}).get("list", [])]
-                    return result_list
-                else:
-                    self.logger.warning(f"{symbol} ({interval}) K線取得APIエラー: {data.get('retMsg')}")
-                    return None
+            result = await self._hedged_request(lambda: self._request_kline(session, params), timeout, self.kline_latency)
+            self.kline_breaker.record_success()
+            return result
+        except BybitAPIError as e:
+            self.logger.warning(f"{symbol} ({interval}) K線取得APIエラー: {e}")
+            upstream_failure = True
+        except asyncio.TimeoutError:
+            self.logger.warning(f"{symbol} ({interval}) K線取得がタイムアウトしました ({timeout:.1f}秒)")
+            upstream_failure = timeout >= self.request_timeout
+        except aiohttp.ClientResponseError as e:
+            self.logger.warning(f"{symbol} ({interval}) K線取得リクエストエラー: {e}")
+            upstream_failure = e.status >= 500
+        except aiohttp.ClientConnectionError as e:
+            self.logger.warning(f"{symbol} ({interval}) K線取得リクエストエラー: {e}")
+            upstream_failure = True
         except (aiohttp.ClientError, ValueError, TypeError, KeyError) as e:
             self.logger.warning(f"{symbol} ({interval}) K線取得リクエスト/パースエラー: {e}")
-            return None
+        if upstream_failure:
+            self.kline_breaker.record_failure()
+        else:
+            self.kline_breaker.record_ignored()
+        return None
+
+    def pop_counters(self) -> dict:
+        counters = dict(self.counters)
+        for key in self.counters:
+            self.counters[key] = 0
+        return counters
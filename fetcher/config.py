@@ -9,12 +9,22 @@ from dotenv import load_dotenv
 LOG_DIR = Path("/app/logs")
 DATA_DIR = Path("/app/data")
 DB_FILE = DATA_DIR / "cmma.db"
+SNAPSHOT_DIR = DATA_DIR / "snapshots"
+PROFILE_DIR = LOG_DIR / "profiles" / "fetcher"
 
 TIMEFRAME_MAP = {
     "1m": "1", "5m": "5", "15m": "15", "30m": "30",
     "1h": "60", "4h": "240", "1d": "D", "1w": "W", "1M": "M"
 }
 
+# 足の長さ(ミリ秒)。月足は最短の28日で近似する（欠損本数を多めに見積もる側に倒す）
+# 月足は間隔が一定でないため、欠損区間の検出対象からは除外する
+TIMEFRAME_MS = {
+    "1m": 60_000, "5m": 300_000, "15m": 900_000, "30m": 1_800_000,
+    "1h": 3_600_000, "4h": 14_400_000, "1d": 86_400_000,
+    "1w": 604_800_000, "1M": 28 * 86_400_000
+}
+
 class AppConfig:
     def __init__(self, dotenv_path=None):
         if dotenv_path:
@@ -27,6 +37,19 @@ class AppConfig:
         self.ohlcv_history_limit = int(os.getenv("OHLCV_HISTORY_LIMIT", "5"))
         self.top_tickers_limit = int(os.getenv("TOP_TICKERS_LIMIT", "30"))
         self.target_symbols_cache_hours = int(os.getenv("TARGET_SYMBOLS_CACHE_HOURS", "24"))
+        self.request_timeout_seconds = float(os.getenv("REQUEST_TIMEOUT_SECONDS", "10"))
+        self.cycle_budget_seconds = float(os.getenv("CYCLE_BUDGET_SECONDS", str(self.fetch_interval_seconds)))
+        self.hedge_enabled = os.getenv("HEDGE_ENABLED", "true").lower() == "true"
+        self.hedge_max_ratio = float(os.getenv("HEDGE_MAX_RATIO", "0.1"))
+        self.circuit_breaker_failure_threshold = int(os.getenv("CIRCUIT_BREAKER_FAILURE_THRESHOLD", "5"))
+        self.circuit_breaker_cooldown_seconds = float(os.getenv("CIRCUIT_BREAKER_COOLDOWN_SECONDS", "30"))
+        self.commit_batch_symbols = int(os.getenv("COMMIT_BATCH_SYMBOLS", str(self.concurrency_limit)))
+        self.gap_repair_max_requests = int(os.getenv("GAP_REPAIR_MAX_REQUESTS", "20"))
+        self.gap_repair_concurrency = int(os.getenv("GAP_REPAIR_CONCURRENCY", "1"))
+        self.gap_repair_max_attempts = int(os.getenv("GAP_REPAIR_MAX_ATTEMPTS", "3"))
+        self.profile_every_n_cycles = int(os.getenv("PROFILE_EVERY_N_CYCLES", "0"))
+        self.profile_max_total_mb = int(os.getenv("PROFILE_MAX_TOTAL_MB", "50"))
+        self.snapshot_enabled = os.getenv("SNAPSHOT_ENABLED", "true").lower() == "true"
         self.base_url = "https://api.bybit.com"
 
 def setup_logging(config: AppConfig) -> logging.Logger:
@@ -3,10 +3,12 @@ import sys
 import traceback
 from datetime import datetime
 
-from config import AppConfig, setup_logging, DB_FILE
+from config import AppConfig, setup_logging, DB_FILE, SNAPSHOT_DIR, PROFILE_DIR
 from client import BybitClient
 from repository import DatabaseRepository
 from service import DataFetchService
+from snapshot import SnapshotPublisher
+from profiling import CycleProfiler
 
 async def main():
     logger = None
@@ -24,13 +26,27 @@ async def main():
         repo = DatabaseRepository(DB_FILE, config.timeframes, logger)
 
         # 4. API Client
-        client = BybitClient(config.base_url, logger)
+        client = BybitClient(
+            config.base_url, logger,
+            request_timeout=config.request_timeout_seconds,
+            hedge_enabled=config.hedge_enabled,
+            hedge_max_ratio=config.hedge_max_ratio,
+            breaker_failure_threshold=config.circuit_breaker_failure_threshold,
+            breaker_cooldown_seconds=config.circuit_breaker_cooldown_seconds,
+        )
 
-        # 5. Service
-        service = DataFetchService(client, repo, config, logger)
+        # 5. Snapshot Publisher (API側のmmap読み取り用)
+        snapshot_publisher = SnapshotPublisher(SNAPSHOT_DIR, logger) if config.snapshot_enabled else None
+
+        # 6. Service
+        service = DataFetchService(client, repo, config, logger, snapshot_publisher)
+
+        # 7. Profiler (PROFILE_EVERY_N_CYCLES > 0 の場合のみ有効)
+        profiler = CycleProfiler(PROFILE_DIR, config.profile_every_n_cycles, config.profile_max_total_mb, logger)
 
         while True:
-            await service.fetch_and_store_data()
+            with profiler.profile_cycle():
+                await service.fetch_and_store_data()
 
             sleep_seconds = config.fetch_interval_seconds
             logger.info(f"{sleep_seconds}秒後に次のサイクルを実行します。")
@@ -0,0 +1,61 @@
+import io
+import time
+import pstats
+import cProfile
+import logging
+from contextlib import contextmanager
+from pathlib import Path
+
+class CycleProfiler:
+    """
+    every_n_cycles サイクルごとに1回、データ取得サイクル全体をcProfileで計測して書き出す。
+    every_n_cycles が0以下の場合は何もしない。
+    """
+    def __init__(self, profile_dir: Path, every_n_cycles: int, max_total_mb: int, logger: logging.Logger):
+        self.profile_dir = profile_dir
+        self.every_n_cycles = every_n_cycles
+        self.max_total_bytes = max_total_mb * 1024 * 1024
+        self.logger = logger
+        self.cycle_count = 0
+
+    @contextmanager
+    def profile_cycle(self):
+        self.cycle_count += 1
+        if self.every_n_cycles <= 0 or self.cycle_count % self.every_n_cycles != 0:
+            yield
+            return
+
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            self._write(profiler, time.perf_counter() - started)
+
+    def _write(self, profiler: cProfile.Profile, wall_seconds: float):
+        try:
+            self.profile_dir.mkdir(parents=True, exist_ok=True)
+            base = self.profile_dir / f"cycle-{time.strftime('%Y%m%d-%H%M%S')}-{self.cycle_count}"
+            profiler.dump_stats(f"{base}.prof")
+
+            summary = io.StringIO()
+            summary.write(f"cycle: {self.cycle_count}\nwall_seconds: {wall_seconds:.2f}\n\n")
+            pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(50)
+            Path(f"{base}.txt").write_text(summary.getvalue(), encoding="utf-8")
+
+            self._enforce_size_limit()
+            self.logger.info(f"サイクル {self.cycle_count} のプロファイルを書き出しました: {base}.prof")
+        except OSError as e:
+            self.logger.warning(f"プロファイルの書き出しに失敗: {e}")
+
+    def _enforce_size_limit(self):
+        """ディレクトリの合計サイズが上限を超えたら古いファイルから削除する"""
+        files = sorted((p for p in self.profile_dir.iterdir() if p.is_file()), key=lambda p: p.stat().st_mtime)
+        total = sum(p.stat().st_size for p in files)
+        for path in files:
+            if total <= self.max_total_bytes:
+                break
+            total -= path.stat().st_size
+            path.unlink(missing_ok=True)
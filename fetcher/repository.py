@@ -2,7 +2,9 @@ import sqlite3
 import logging
 import sys
 from pathlib import Path
-from typing import List, Tuple, Set
+from typing import Dict, List, Optional, Tuple, Set
+
+from stats import ReturnStats
 
 class DatabaseRepository:
     def __init__(self, db_file: Path, timeframes: List[str], logger: logging.Logger):
@@ -37,6 +39,78 @@ class DatabaseRepository:
                     PRIMARY KEY (symbol, timestamp)
                 )
                 """)
+
+            # 再起動時のウォームスタート用の状態テーブル
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS fetcher_state (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                updated_at INTEGER NOT NULL
+            )
+            """)
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS fetch_progress (
+                timeframe TEXT NOT NULL,
+                symbol TEXT NOT NULL,
+                last_candle_ts INTEGER NOT NULL,
+                PRIMARY KEY (timeframe, symbol)
+            )
+            """)
+            # 欠損区間(ギャップ)の検出結果と、タイムフレームごとの集計
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ohlcv_gaps (
+                timeframe TEXT NOT NULL,
+                symbol TEXT NOT NULL,
+                gap_start INTEGER NOT NULL,
+                gap_end INTEGER NOT NULL,
+                missing_bars INTEGER NOT NULL,
+                repair_attempts INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (timeframe, symbol, gap_start)
+            )
+            """)
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ohlcv_gap_summary (
+                timeframe TEXT PRIMARY KEY,
+                gap_count INTEGER NOT NULL,
+                missing_bars INTEGER NOT NULL,
+                affected_symbols INTEGER NOT NULL,
+                scanned_at INTEGER NOT NULL
+            )
+            """)
+            # 銘柄・タイムフレームごとの確定足リターンの累積統計 (Welford法)
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS return_stats (
+                timeframe TEXT NOT NULL,
+                symbol TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                mean REAL NOT NULL,
+                m2 REAL NOT NULL,
+                last_ts INTEGER NOT NULL,
+                last_close REAL NOT NULL,
+                PRIMARY KEY (timeframe, symbol)
+            )
+            """)
+            # 全銘柄のTicker情報 (毎サイクル全件を置き換える)
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS ticker_snapshot (
+                symbol TEXT PRIMARY KEY,
+                last_price REAL NOT NULL,
+                prev_price_1h REAL NOT NULL,
+                prev_price_24h REAL NOT NULL,
+                price_24h_pcnt REAL NOT NULL,
+                turnover_24h REAL NOT NULL,
+                volume_24h REAL NOT NULL,
+                updated_at INTEGER NOT NULL
+            )
+            """)
+            # 既存DB（状態テーブル導入前）からの移行: 保存済みの最新足で初期化する
+            for tf in self.timeframes:
+                tf_clean = tf.strip()
+                if not tf_clean: continue
+                cursor.execute(f"""
+                INSERT OR IGNORE INTO fetch_progress (timeframe, symbol, last_candle_ts)
+                SELECT ?, symbol, MAX(timestamp) FROM {self.get_table_name(tf_clean)} GROUP BY symbol
+                """, (tf_clean,))
             conn.commit()
             self.logger.info("全テーブルの準備完了。")
             return conn
@@ -47,9 +121,9 @@ class DatabaseRepository:
     def get_table_name(self, timeframe: str) -> str:
         return f"ohlcv_{timeframe}"
 
-    def upsert_ohlcv_data(self, timeframe: str, records: List[Tuple]):
+    def upsert_ohlcv_data(self, timeframe: str, records: List[Tuple]) -> bool:
         if not records:
-            return
+            return False
 
         table_name = self.get_table_name(timeframe)
         self.logger.info(f"[{timeframe}] {len(records)} 件のレコードをテーブル '{table_name}' にUPSERTします...")
@@ -67,11 +141,43 @@ class DatabaseRepository:
                 turnover=excluded.turnover
             """
             cursor.executemany(upsert_sql, records)
+
+            # 銘柄ごとの最新足を同じトランザクションで記録する
+            latest = {}
+            for rec in records:
+                if rec[1] > latest.get(rec[0], -1):
+                    latest[rec[0]] = rec[1]
+            cursor.executemany("""
+            INSERT INTO fetch_progress (timeframe, symbol, last_candle_ts)
+            VALUES (?, ?, ?)
+            ON CONFLICT(timeframe, symbol) DO UPDATE SET
+                last_candle_ts=MAX(last_candle_ts, excluded.last_candle_ts)
+            """, [(timeframe, symbol, ts) for symbol, ts in latest.items()])
+
             self.conn.commit()
             self.logger.info(f"[{timeframe}] UPSERTが完了しました。")
+            return True
         except sqlite3.Error as e:
             self.logger.error(f"[{timeframe}] DB保存中にエラー: {e}")
             self.conn.rollback()
+            return False
+
+    def replace_ticker_snapshot(self, records: List[Tuple]):
+        """Tickerスナップショットを1トランザクションで全件置き換える（上場廃止銘柄も残らない）"""
+        if not records:
+            return
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("DELETE FROM ticker_snapshot")
+            cursor.executemany("""
+            INSERT INTO ticker_snapshot (symbol, last_price, prev_price_1h, prev_price_24h, price_24h_pcnt, turnover_24h, volume_24h, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, records)
+            self.conn.commit()
+            self.logger.info(f"Tickerスナップショットを更新しました ({len(records)}銘柄)")
+        except sqlite3.Error as e:
+            self.logger.error(f"Tickerスナップショットの保存中にエラー: {e}")
+            self.conn.rollback()
 
     def cleanup_old_ohlcv_data(self, timeframe: str, symbols: Set[str], history_limit: int):
         if not symbols:
@@ -97,6 +203,163 @@ class DatabaseRepository:
             self.logger.error(f"[{timeframe}] DBクリーンアップ中にエラー: {e}")
             self.conn.rollback()
 
+    def scan_gaps(self, timeframe: str, interval_ms: int) -> int:
+        """
+        主キー(symbol, timestamp)の順に1回走査し、連続する足の間隔がinterval_msを超える箇所を欠損区間として記録する。
+        既に記録済みの区間は補修試行回数を引き継ぐ。検出した区間数を返す。
+        """
+        table_name = self.get_table_name(timeframe)
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(f"""
+            SELECT symbol, prev_ts + :interval_ms, timestamp - :interval_ms, (timestamp - prev_ts) / :interval_ms - 1
+            FROM (
+                SELECT
+                    symbol,
+                    timestamp,
+                    LAG(timestamp) OVER (PARTITION BY symbol ORDER BY timestamp) AS prev_ts
+                FROM {table_name}
+            )
+            WHERE timestamp - prev_ts > :interval_ms
+            """, {"interval_ms": interval_ms})
+            gaps = cursor.fetchall()
+
+            cursor.execute("SELECT symbol, gap_start, repair_attempts FROM ohlcv_gaps WHERE timeframe = ?", (timeframe,))
+            attempts = {(row[0], row[1]): row[2] for row in cursor.fetchall()}
+
+            cursor.execute("DELETE FROM ohlcv_gaps WHERE timeframe = ?", (timeframe,))
+            cursor.executemany("""
+            INSERT INTO ohlcv_gaps (timeframe, symbol, gap_start, gap_end, missing_bars, repair_attempts)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """, [(timeframe, g[0], g[1], g[2], g[3], attempts.get((g[0], g[1]), 0)) for g in gaps])
+            cursor.execute("""
+            INSERT INTO ohlcv_gap_summary (timeframe, gap_count, missing_bars, affected_symbols, scanned_at)
+            VALUES (?, ?, ?, ?, strftime('%s', 'now'))
+            ON CONFLICT(timeframe) DO UPDATE SET
+                gap_count=excluded.gap_count,
+                missing_bars=excluded.missing_bars,
+                affected_symbols=excluded.affected_symbols,
+                scanned_at=excluded.scanned_at
+            """, (timeframe, len(gaps), sum(g[3] for g in gaps), len({g[0] for g in gaps})))
+            self.conn.commit()
+            return len(gaps)
+        except sqlite3.Error as e:
+            self.logger.error(f"[{timeframe}] 欠損区間の検出中にエラー: {e}")
+            self.conn.rollback()
+            return 0
+
+    def get_pending_gaps(self, max_attempts: int, limit: int) -> List[Tuple]:
+        """補修対象の欠損区間 (timeframe, symbol, gap_start, gap_end, missing_bars) を新しい順に返す"""
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("""
+            SELECT timeframe, symbol, gap_start, gap_end, missing_bars
+            FROM ohlcv_gaps
+            WHERE repair_attempts < ?
+            ORDER BY gap_end DESC
+            LIMIT ?
+            """, (max_attempts, limit))
+            return cursor.fetchall()
+        except sqlite3.Error as e:
+            self.logger.error(f"補修対象の欠損区間の取得中にエラー: {e}")
+            return []
+
+    def increment_gap_repair_attempts(self, gaps: List[Tuple[str, str, int]]):
+        """gapsは (timeframe, symbol, gap_start) のリスト"""
+        cursor = self.conn.cursor()
+        try:
+            cursor.executemany("""
+            UPDATE ohlcv_gaps SET repair_attempts = repair_attempts + 1
+            WHERE timeframe = ? AND symbol = ? AND gap_start = ?
+            """, gaps)
+            self.conn.commit()
+        except sqlite3.Error as e:
+            self.logger.error(f"欠損区間の補修試行回数の更新中にエラー: {e}")
+            self.conn.rollback()
+
+    def get_return_stats(self, timeframe: str) -> Dict[str, ReturnStats]:
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("""
+            SELECT symbol, count, mean, m2, last_ts, last_close
+            FROM return_stats WHERE timeframe = ?
+            """, (timeframe,))
+            return {row[0]: ReturnStats(*row[1:]) for row in cursor.fetchall()}
+        except sqlite3.Error as e:
+            self.logger.error(f"[{timeframe}] リターン統計の読み出し中にエラー: {e}")
+            return {}
+
+    def save_return_stats(self, timeframe: str, stats: Dict[str, ReturnStats]):
+        if not stats:
+            return
+        cursor = self.conn.cursor()
+        try:
+            cursor.executemany("""
+            INSERT INTO return_stats (timeframe, symbol, count, mean, m2, last_ts, last_close)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(timeframe, symbol) DO UPDATE SET
+                count=excluded.count,
+                mean=excluded.mean,
+                m2=excluded.m2,
+                last_ts=excluded.last_ts,
+                last_close=excluded.last_close
+            """, [(timeframe, symbol, *st) for symbol, st in stats.items()])
+            self.conn.commit()
+        except sqlite3.Error as e:
+            self.logger.error(f"[{timeframe}] リターン統計の保存中にエラー: {e}")
+            self.conn.rollback()
+
+    def get_last_candle_timestamps(self, timeframe: str) -> Dict[str, int]:
+        """銘柄ごとに保存済みの最新足のタイムスタンプを返す"""
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("SELECT symbol, last_candle_ts FROM fetch_progress WHERE timeframe = ?", (timeframe,))
+            return dict(cursor.fetchall())
+        except sqlite3.Error as e:
+            self.logger.error(f"[{timeframe}] 取得状況の読み出し中にエラー: {e}")
+            return {}
+
+    def get_state(self, key: str) -> Optional[str]:
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("SELECT value FROM fetcher_state WHERE key = ?", (key,))
+            row = cursor.fetchone()
+            return row[0] if row else None
+        except sqlite3.Error as e:
+            self.logger.error(f"状態 '{key}' の読み出し中にエラー: {e}")
+            return None
+
+    def set_state(self, values: Dict[str, str]):
+        """複数のキーを1トランザクションで保存する"""
+        cursor = self.conn.cursor()
+        try:
+            cursor.executemany("""
+            INSERT INTO fetcher_state (key, value, updated_at)
+            VALUES (?, ?, strftime('%s', 'now'))
+            ON CONFLICT(key) DO UPDATE SET
+                value=excluded.value,
+                updated_at=excluded.updated_at
+            """, list(values.items()))
+            self.conn.commit()
+        except sqlite3.Error as e:
+            self.logger.error(f"状態の保存中にエラー: {e}")
+            self.conn.rollback()
+
+    def fetch_all_ohlcv(self, timeframe: str) -> List[Tuple]:
+        """スナップショット用に、テーブル全体を symbol昇順・timestamp降順 で取得する"""
+        table_name = self.get_table_name(timeframe)
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(f"""
+            SELECT symbol, timestamp, open, high, low, close, volume, turnover
+            FROM {table_name}
+            ORDER BY symbol ASC, timestamp DESC
+            """)
+            return cursor.fetchall()
+        except sqlite3.Error as e:
+            self.logger.error(f"[{timeframe}] OHLCVの読み出し中にエラー: {e}")
+            return []
+
     def close(self):
         if self.conn:
             self.conn.close()
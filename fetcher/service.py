@@ -1,34 +1,177 @@
 import asyncio
+import json
 import time
 import logging
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime, timedelta
 
 import aiohttp
 
-from client import BybitClient
+from client import BybitClient, RequestSkipped
 from repository import DatabaseRepository
-from config import AppConfig, TIMEFRAME_MAP
+from snapshot import SnapshotPublisher
+from stats import update_return_stats
+from config import AppConfig, TIMEFRAME_MAP, TIMEFRAME_MS
 
 class DataFetchService:
-    def __init__(self, client: BybitClient, repository: DatabaseRepository, config: AppConfig, logger: logging.Logger):
+    def __init__(self, client: BybitClient, repository: DatabaseRepository, config: AppConfig, logger: logging.Logger, snapshot_publisher: Optional[SnapshotPublisher] = None):
         self.client = client
         self.repository = repository
+        self.snapshot_publisher = snapshot_publisher
         self.config = config
         self.logger = logger
         self.target_symbols_cache = []
         self.target_symbols_timestamp = None
         self.cache_duration = timedelta(hours=self.config.target_symbols_cache_hours)
+        # timeframe -> {symbol: 保存済みの最新足のタイムスタンプ}
+        self.last_candle_ts: Dict[str, Dict[str, int]] = {}
+        self.started_at = time.time()
+        self.first_fresh_reported = False
+        self._restore_state()
+
+    def _restore_state(self):
+        """前回の実行状態をDBから復元し、初回サイクルで不足分だけを取得できるようにする"""
+        symbols_json = self.repository.get_state("target_symbols")
+        symbols_ts = self.repository.get_state("target_symbols_timestamp")
+        if symbols_json and symbols_ts:
+            try:
+                self.target_symbols_cache = json.loads(symbols_json)
+                self.target_symbols_timestamp = datetime.fromisoformat(symbols_ts)
+                self.logger.info(f"ターゲット銘柄のキャッシュを復元しました ({len(self.target_symbols_cache)}銘柄, 選定日時: {symbols_ts})")
+            except ValueError as e:
+                self.logger.warning(f"ターゲット銘柄のキャッシュを復元できませんでした: {e}")
+                self.target_symbols_cache = []
+                self.target_symbols_timestamp = None
+
+        for timeframe_str in self.config.timeframes:
+            timeframe_str = timeframe_str.strip()
+            if not timeframe_str: continue
+            self.last_candle_ts[timeframe_str] = self.repository.get_last_candle_timestamps(timeframe_str)
+
+        last_completed = self.repository.get_state("last_cycle_completed_at")
+        if last_completed:
+            self.logger.info(f"前回のサイクル完了日時: {last_completed}")
+
+    def _get_fetch_limit(self, timeframe_str: str, symbol: str, now_ms: int) -> int:
+        """保存済みの最新足から現在までの本数（最新足の再取得を含む）だけを取得する"""
+        last_ts = self.last_candle_ts.get(timeframe_str, {}).get(symbol)
+        interval_ms = TIMEFRAME_MS.get(timeframe_str)
+        if last_ts is None or not interval_ms:
+            return self.config.ohlcv_history_limit
+        missing = (now_ms - last_ts) // interval_ms + 1
+        return max(1, min(self.config.ohlcv_history_limit, missing))
+
+    def _store_records(self, timeframe_str: str, records: List[Tuple]) -> bool:
+        """取得済みのレコードをコミットし、最新足・リターン統計を更新して古い足を削除する"""
+        if not self.repository.upsert_ohlcv_data(timeframe_str, records):
+            return False
+
+        last_ts_map = self.last_candle_ts.setdefault(timeframe_str, {})
+        for rec in records:
+            if rec[1] > last_ts_map.get(rec[0], -1):
+                last_ts_map[rec[0]] = rec[1]
+
+        # 新しく確定した足のリターンだけを累積統計に加える (1本あたりO(1))
+        interval_ms = TIMEFRAME_MS.get(timeframe_str) if timeframe_str != "1M" else None
+        updated_stats = update_return_stats(self.repository.get_return_stats(timeframe_str), records, interval_ms)
+        self.repository.save_return_stats(timeframe_str, updated_stats)
+
+        upserted_symbols = {rec[0] for rec in records}
+        self.repository.cleanup_old_ohlcv_data(timeframe_str, upserted_symbols, self.config.ohlcv_history_limit)
+        return True
+
+    def _publish_snapshot(self, timeframe_str: str):
+        """コミット後の状態をスナップショットとして公開する (APIはこれをmmapして読む)"""
+        if self.snapshot_publisher:
+            self.snapshot_publisher.publish(timeframe_str, self.repository.fetch_all_ohlcv(timeframe_str))
+
+    def _scan_gaps(self, timeframe_str: str):
+        if timeframe_str == "1M" or timeframe_str not in TIMEFRAME_MS:
+            return
+        gap_count = self.repository.scan_gaps(timeframe_str, TIMEFRAME_MS[timeframe_str])
+        if gap_count:
+            self.logger.warning(f"[{timeframe_str}] {gap_count} 件の欠損区間を検出しました。")
+
+    async def _repair_gaps(self, session: aiohttp.ClientSession, deadline: Optional[float] = None):
+        """検出済みの欠損区間を、1サイクルあたりのリクエスト数と同時実行数を絞って補修する"""
+        if self.config.gap_repair_max_requests <= 0:
+            return
+        timeframes = {tf.strip() for tf in self.config.timeframes}
+        gaps = [
+            gap for gap in self.repository.get_pending_gaps(self.config.gap_repair_max_attempts, self.config.gap_repair_max_requests)
+            if gap[0] in timeframes
+        ]
+        if not gaps:
+            return
+
+        self.logger.info(f"欠損区間の補修を開始します ({len(gaps)}件)")
+        sem = asyncio.Semaphore(self.config.gap_repair_concurrency)
+
+        async def repair_one(gap):
+            """(リクエストを送ったかどうか, 取得したK線) を返す"""
+            timeframe_str, symbol, gap_start, gap_end, missing_bars = gap
+            async with sem:
+                try:
+                    return True, await self.client.get_kline_data(
+                        session, symbol, TIMEFRAME_MAP[timeframe_str],
+                        limit=min(missing_bars, 1000), start=gap_start, end=gap_end, deadline=deadline
+                    )
+                except RequestSkipped:
+                    return False, None
+
+        results = await asyncio.gather(*(repair_one(gap) for gap in gaps))
+
+        records_by_timeframe = {}
+        for (timeframe_str, symbol, gap_start, gap_end, _), (_, ohlcv_data) in zip(gaps, results):
+            for row in ohlcv_data or []:
+                if gap_start <= row[0] <= gap_end:
+                    records_by_timeframe.setdefault(timeframe_str, []).append((
+                        symbol, row[0], row[1], row[2], row[3], row[4], row[5], row[6]
+                    ))
+
+        # 補修できた区間は再走査で消えるため、実際にリクエストを送った区間の試行回数は一律に加算する。
+        # ブレーカーや期限切れで送れなかった区間は、障害中に諦めてしまわないよう試行に数えない
+        self.repository.increment_gap_repair_attempts([
+            (gap[0], gap[1], gap[2]) for gap, (sent, _) in zip(gaps, results) if sent
+        ])
+
+        for timeframe_str, records in records_by_timeframe.items():
+            if self.repository.upsert_ohlcv_data(timeframe_str, records):
+                self._scan_gaps(timeframe_str)
+                self._publish_snapshot(timeframe_str)
+
+        repaired = sum(len(records) for records in records_by_timeframe.values())
+        self.logger.info(f"欠損区間の補修が完了しました (補完した足: {repaired}本)")
+
+    def _to_ticker_records(self, tickers: List[dict]) -> List[Tuple]:
+        """Ticker情報を (symbol, last_price, prev_price_1h, prev_price_24h, price_24h_pcnt, turnover_24h, volume_24h, updated_at) に変換する"""
+        updated_at = int(time.time() * 1000)
+        records = []
+        for t in tickers:
+            try:
+                records.append((
+                    t["symbol"], float(t["lastPrice"]), float(t["prevPrice1h"]), float(t["prevPrice24h"]),
+                    float(t["price24hPcnt"]), float(t["turnover24h"]), float(t["volume24h"]), updated_at
+                ))
+            except (KeyError, ValueError, TypeError):
+                # 上場直後などで値が空の銘柄は対象外
+                continue
+        return records
 
     async def fetch_and_store_data(self):
         start_time = time.time()
         self.logger.info("====== 新しいデータ取得サイクルを開始 ======")
 
         async with aiohttp.ClientSession(timeout=self.client.timeout) as session:
+            # 0. 全銘柄のTickerを毎サイクル1リクエストで取得し、スナップショットとして保存する
+            tickers = await self.client.get_linear_tickers(session)
+            if tickers:
+                self.repository.replace_ticker_snapshot(self._to_ticker_records(tickers))
+
             # 1. Update Target Cache if needed (Older than 24h or empty)
             now = datetime.now()
             if not self.target_symbols_cache or not self.target_symbols_timestamp or (now - self.target_symbols_timestamp) > self.cache_duration:
                 self.logger.info(f"ターゲット銘柄（出来高上位{self.config.top_tickers_limit}）を選定・更新します...")
-                tickers = await self.client.get_linear_tickers(session)
                 
                 if not tickers:
                     self.logger.error("Ticker情報の取得に失敗したため、キャッシュ更新をスキップします。")
@@ -43,6 +186,10 @@ class DataFetchService:
                         top_tickers = tickers[:self.config.top_tickers_limit]
                         self.target_symbols_cache = [t["symbol"] for t in top_tickers]
                         self.target_symbols_timestamp = now
+                        self.repository.set_state({
+                            "target_symbols": json.dumps(self.target_symbols_cache),
+                            "target_symbols_timestamp": now.isoformat(),
+                        })
                         
                         log_msg = "【選定銘柄と24時間変動率】\n"
                         for t in top_tickers:
@@ -60,11 +207,12 @@ class DataFetchService:
                 return
 
             self.logger.info(f"対象タイムフレーム: {self.config.timeframes}")
+            fresh_data_stored = False
+            loop = asyncio.get_running_loop()
+            cycle_deadline = loop.time() + self.config.cycle_budget_seconds - (time.time() - start_time)
+            timeframes = [tf.strip() for tf in self.config.timeframes if tf.strip()]
 
-            for timeframe_str in self.config.timeframes:
-                timeframe_str = timeframe_str.strip()
-                if not timeframe_str: continue
-
+            for index, timeframe_str in enumerate(timeframes):
                 interval = TIMEFRAME_MAP.get(timeframe_str)
                 if not interval:
                     self.logger.warning(f"未対応のタイムフレーム: {timeframe_str}。スキップします。")
@@ -73,29 +221,64 @@ class DataFetchService:
                 self.logger.info(f"--- タイムフレーム: {timeframe_str} ({interval}) のデータ取得を開始 (対象: {len(symbols)}銘柄) ---")
 
                 sem = asyncio.Semaphore(self.config.concurrency_limit)
+                now_ms = int(time.time() * 1000)
+                # サイクルの残り時間を、残りのタイムフレームで等分した期限を各リクエストに課す
+                timeframe_deadline = loop.time() + (cycle_deadline - loop.time()) / (len(timeframes) - index)
 
                 async def fetch_one(symbol: str):
                     async with sem:
-                        return await self.client.get_kline_data(session, symbol, interval, limit=self.config.ohlcv_history_limit)
+                        limit = self._get_fetch_limit(timeframe_str, symbol, now_ms)
+                        try:
+                            return symbol, await self.client.get_kline_data(session, symbol, interval, limit=limit, deadline=timeframe_deadline)
+                        except RequestSkipped:
+                            return symbol, None
 
-                tasks = [fetch_one(symbol) for symbol in symbols]
-                results = await asyncio.gather(*tasks)
-
-                records_to_upsert = []
-                for symbol, ohlcv_data in zip(symbols, results):
+                # 応答が揃うのを待たず、届いた分から一定件数ごとにコミットする
+                timeframe_stored = False
+                pending_records = []
+                pending_symbols = 0
+                for future in asyncio.as_completed([fetch_one(symbol) for symbol in symbols]):
+                    symbol, ohlcv_data = await future
                     if ohlcv_data:
                         for row in ohlcv_data:
-                            records_to_upsert.append((
+                            pending_records.append((
                                 symbol, row[0], row[1], row[2], row[3], row[4], row[5], row[6]
                             ))
+                        pending_symbols += 1
+                    if pending_symbols >= self.config.commit_batch_symbols:
+                        timeframe_stored |= self._store_records(timeframe_str, pending_records)
+                        pending_records, pending_symbols = [], 0
+                if pending_records:
+                    timeframe_stored |= self._store_records(timeframe_str, pending_records)
+
+                if timeframe_stored:
+                    fresh_data_stored = True
+                    self._scan_gaps(timeframe_str)
+                    self._publish_snapshot(timeframe_str)
+
+                counters = self.client.pop_counters()
+                self.logger.info(
+                    f"--- タイムフレーム: {timeframe_str} のデータ取得が完了 "
+                    f"(ヘッジ: {counters['hedged']}件, 期限切れ: {counters['deadline_skipped']}件, "
+                    f"ブレーカーによるスキップ: {counters['breaker_skipped']}件) ---"
+                )
 
-                if records_to_upsert:
-                    self.repository.upsert_ohlcv_data(timeframe_str, records_to_upsert)
+            # 欠損区間の補修は最新データの取得を優先し、サイクルの最後に行う
+            await self._repair_gaps(session, cycle_deadline)
 
-                    upserted_symbols = {rec[0] for rec in records_to_upsert}
-                    self.repository.cleanup_old_ohlcv_data(timeframe_str, upserted_symbols, self.config.ohlcv_history_limit)
+            end_time = time.time()
+            self.repository.set_state({
+                "last_cycle_started_at": datetime.fromtimestamp(start_time).isoformat(),
+                "last_cycle_completed_at": datetime.fromtimestamp(end_time).isoformat(),
+                "last_cycle_duration_seconds": f"{end_time - start_time:.2f}",
+            })
 
-                self.logger.info(f"--- タイムフレーム: {timeframe_str} のデータ取得が完了 ---")
+            if fresh_data_stored and not self.first_fresh_reported:
+                self.first_fresh_reported = True
+                startup_seconds = end_time - self.started_at
+                self.repository.set_state({"startup_to_first_fresh_seconds": f"{startup_seconds:.2f}"})
+                self.logger.info(f"起動から最初の最新データ反映までの所要時間: {startup_seconds:.2f}秒")
 
-        end_time = time.time()
-        self.logger.info(f"====== データ取得サイクル完了 (所要時間: {end_time - start_time:.2f}秒) ======")
\ No newline at end of file
+        self.logger.info(f"====== データ取得サイクル完了 (所要時間: {end_time - start_time:.2f}秒) ======")
+        if end_time - start_time > self.config.fetch_interval_seconds:
+            self.logger.warning(f"サイクルの所要時間がFETCH_INTERVAL_SECONDS ({self.config.fetch_interval_seconds}秒) を超えました。PROFILE_EVERY_N_CYCLESで内訳を確認できます。")
\ No newline at end of file
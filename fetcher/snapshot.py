@@ -0,0 +1,49 @@
+import os
+import logging
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+
+# APIサーバー側(api/snapshot.py)と同じレイアウトであること。
+# symbolは固定長バイト列にして、1ファイル(=1回のrename)で完結させる。
+SNAPSHOT_DTYPE = np.dtype([
+    ("symbol", "S32"),
+    ("timestamp", "<i8"),
+    ("open", "<f8"),
+    ("high", "<f8"),
+    ("low", "<f8"),
+    ("close", "<f8"),
+    ("volume", "<f8"),
+    ("turnover", "<f8"),
+])
+
+class SnapshotPublisher:
+    """
+    タイムフレームごとのOHLCVを固定長のNumPy構造化配列(.npy)として書き出す。
+    APIサーバーはこのファイルをmmapして読み取るため、書き込みは一時ファイル + renameで原子的に行う。
+    """
+    def __init__(self, snapshot_dir: Path, logger: logging.Logger):
+        self.snapshot_dir = snapshot_dir
+        self.logger = logger
+
+    def get_snapshot_path(self, timeframe: str) -> Path:
+        return self.snapshot_dir / f"ohlcv_{timeframe}.npy"
+
+    def publish(self, timeframe: str, rows: List[Tuple]):
+        """rowsは (symbol, timestamp, open, high, low, close, volume, turnover) を symbol昇順・timestamp降順 で渡すこと"""
+        path = self.get_snapshot_path(timeframe)
+        tmp_path = path.with_name(path.name + ".tmp")
+        try:
+            self.snapshot_dir.mkdir(parents=True, exist_ok=True)
+            array = np.array(rows, dtype=SNAPSHOT_DTYPE)
+            with open(tmp_path, "wb") as f:
+                np.save(f, array)
+                f.flush()
+                os.fsync(f.fileno())
+            # 既存ファイルをmmap中の読み手は旧inodeを参照し続けるため、置き換えは安全
+            os.replace(tmp_path, path)
+            self.logger.info(f"[{timeframe}] スナップショットを公開しました: {path} ({len(array)} 件)")
+        except (OSError, ValueError, UnicodeEncodeError) as e:
+            self.logger.error(f"[{timeframe}] スナップショットの公開に失敗: {e}")
+            tmp_path.unlink(missing_ok=True)
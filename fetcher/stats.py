@@ -0,0 +1,46 @@
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+class ReturnStats(NamedTuple):
+    """銘柄・タイムフレームごとの確定足リターンの累積統計 (Welford法)"""
+    count: int
+    mean: float
+    m2: float
+    last_ts: int
+    last_close: float
+
+def welford_update(stats: ReturnStats, value: float, ts: int, close: float) -> ReturnStats:
+    """1本分のリターンを O(1) で統計に加える"""
+    count = stats.count + 1
+    delta = value - stats.mean
+    mean = stats.mean + delta / count
+    m2 = stats.m2 + delta * (value - mean)
+    return ReturnStats(count, mean, m2, ts, close)
+
+def update_return_stats(current: Dict[str, ReturnStats], records: List[Tuple], interval_ms: Optional[int]) -> Dict[str, ReturnStats]:
+    """
+    UPSERTしたレコードのうち、前回までに取り込んだ足より新しい確定足だけを統計に加える。
+    各銘柄の最新足は未確定のため取り込まない。interval_msが指定されていれば、
+    欠損を挟んだ足同士のリターンは統計に含めず、基準の足だけを進める。
+    更新があった銘柄の統計を返す。
+    """
+    bars_by_symbol: Dict[str, List[Tuple[int, float]]] = {}
+    for rec in records:
+        bars_by_symbol.setdefault(rec[0], []).append((rec[1], rec[5]))
+
+    updated = {}
+    for symbol, bars in bars_by_symbol.items():
+        bars.sort()
+        stats = current.get(symbol)
+        for ts, close in bars[:-1]:
+            if stats is None:
+                stats = ReturnStats(0, 0.0, 0.0, ts, close)
+            elif ts > stats.last_ts:
+                contiguous = interval_ms is None or ts - stats.last_ts == interval_ms
+                if contiguous and stats.last_close:
+                    stats = welford_update(stats, close / stats.last_close - 1, ts, close)
+                else:
+                    stats = stats._replace(last_ts=ts, last_close=close)
+            else:
+                continue
+            updated[symbol] = stats
+    return updated
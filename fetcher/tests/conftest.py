@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# fetcherのモジュールはコンテナ内で /app 直下からimportされる前提のため、同じ形で読み込めるようにする
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,48 @@
+import asyncio
+from collections import defaultdict
+
+from aiohttp import web
+
+class StubExchange:
+    """
+    /v5/market/kline と /v5/market/tickers だけを返すBybitのスタブ。
+    kline_behaviour(symbol, n) が (遅延秒数, retCode) を返し、n はその銘柄への何回目のリクエストか(0始まり)。
+    """
+    def __init__(self, kline_behaviour=None, tickers=None):
+        self.kline_behaviour = kline_behaviour or (lambda symbol, n: (0, 0))
+        self.tickers = tickers or []
+        self.calls = defaultdict(list)
+        self.runner = None
+        self.base_url = None
+
+    async def _kline(self, request: web.Request) -> web.Response:
+        symbol = request.query["symbol"]
+        n = len(self.calls[symbol])
+        self.calls[symbol].append(asyncio.get_running_loop().time())
+        delay, ret_code = self.kline_behaviour(symbol, n)
+        if delay:
+            await asyncio.sleep(delay)
+        if ret_code != 0:
+            return web.json_response({"retCode": ret_code, "retMsg": "injected error", "result": {}})
+        limit = int(request.query.get("limit", 5))
+        bar_ms = 3_600_000
+        latest = 1_700_000_000_000 // bar_ms * bar_ms
+        rows = [[str(latest - i * bar_ms), "1", "2", "0.5", "1.5", "10", "15"] for i in range(limit)]
+        return web.json_response({"retCode": 0, "retMsg": "OK", "result": {"list": rows}})
+
+    async def _tickers(self, request: web.Request) -> web.Response:
+        return web.json_response({"retCode": 0, "retMsg": "OK", "result": {"list": self.tickers}})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/v5/market/kline", self._kline)
+        app.router.add_get("/v5/market/tickers", self._tickers)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = self.runner.addresses[0][:2]
+        self.base_url = f"http://{host}:{port}"
+
+    async def stop(self):
+        await self.runner.cleanup()
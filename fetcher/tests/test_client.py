@@ -0,0 +1,227 @@
+import gc
+import asyncio
+import logging
+import time
+
+import aiohttp
+import pytest
+
+from client import BybitClient, RequestSkipped
+from config import AppConfig
+from repository import DatabaseRepository
+from service import DataFetchService
+from stub_exchange import StubExchange
+
+logger = logging.getLogger("test_fetcher")
+
+def run(scenario):
+    """
+    scenario(stub_factory) をイベントループ上で実行する。
+    回収されなかったタスクの例外など、ループに報告された例外があれば失敗にする。
+    """
+    loop_errors = []
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        loop.set_exception_handler(lambda _, context: loop_errors.append(context))
+        stubs = []
+
+        async def stub_factory(**kwargs) -> StubExchange:
+            stub = StubExchange(**kwargs)
+            await stub.start()
+            stubs.append(stub)
+            return stub
+
+        try:
+            await scenario(stub_factory)
+            # 捨てられたタスクの後始末と、未回収例外の報告を待つ
+            await asyncio.sleep(0.05)
+            gc.collect()
+            await asyncio.sleep(0.05)
+        finally:
+            for stub in stubs:
+                await stub.stop()
+
+    asyncio.run(main())
+    assert loop_errors == []
+
+def make_client(stub: StubExchange, **kwargs) -> BybitClient:
+    options = {"request_timeout": 2, "breaker_failure_threshold": 3, "breaker_cooldown_seconds": 0.3}
+    options.update(kwargs)
+    return BybitClient(stub.base_url, logger, **options)
+
+def test_hedge_is_sent_after_p95_and_faster_response_wins():
+    async def scenario(stub_factory):
+        # HEDGEの1本目だけ遅く、ヘッジで送られる2本目はすぐに返る
+        stub = await stub_factory(kline_behaviour=lambda symbol, n: (1.0, 0) if symbol == "HEDGE" and n == 0 else (0, 0))
+        client = make_client(stub)
+        async with aiohttp.ClientSession(timeout=client.timeout) as session:
+            for _ in range(20):
+                assert await client.get_kline_data(session, "FAST", "60") is not None
+            p95 = client.kline_latency.p95()
+            assert p95 is not None
+            client.pop_counters()
+
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            result = await client.get_kline_data(session, "HEDGE", "60")
+            elapsed = loop.time() - started
+
+        assert result is not None
+        assert elapsed < 0.5
+        assert client.pop_counters()["hedged"] == 1
+        first, second = stub.calls["HEDGE"]
+        assert second - first >= p95 * 0.9
+
+    run(scenario)
+
+def test_breaker_opens_after_errors_and_probe_closes_it():
+    async def scenario(stub_factory):
+        failing = {"on": True}
+        stub = await stub_factory(kline_behaviour=lambda symbol, n: (0, 10006 if failing["on"] else 0))
+        client = make_client(stub)
+        async with aiohttp.ClientSession(timeout=client.timeout) as session:
+            for _ in range(3):
+                assert await client.get_kline_data(session, "ERR", "60") is None
+            assert client.kline_breaker.opened_at is not None
+
+            with pytest.raises(RequestSkipped):
+                await client.get_kline_data(session, "ERR", "60")
+            assert len(stub.calls["ERR"]) == 3
+
+            failing["on"] = False
+            await asyncio.sleep(0.35)
+            assert await client.get_kline_data(session, "ERR", "60") is not None
+            assert client.kline_breaker.opened_at is None
+            assert await client.get_kline_data(session, "ERR", "60") is not None
+
+        assert client.pop_counters()["breaker_skipped"] == 1
+
+    run(scenario)
+
+def test_failed_probe_reopens_breaker():
+    async def scenario(stub_factory):
+        stub = await stub_factory(kline_behaviour=lambda symbol, n: (0, 10006))
+        client = make_client(stub)
+        async with aiohttp.ClientSession(timeout=client.timeout) as session:
+            for _ in range(3):
+                await client.get_kline_data(session, "ERR", "60")
+            await asyncio.sleep(0.35)
+            assert await client.get_kline_data(session, "ERR", "60") is None
+            with pytest.raises(RequestSkipped):
+                await client.get_kline_data(session, "ERR", "60")
+        assert len(stub.calls["ERR"]) == 4
+
+    run(scenario)
+
+def test_deadline_clips_timeout_and_skips_expired_requests():
+    async def scenario(stub_factory):
+        stub = await stub_factory(kline_behaviour=lambda symbol, n: (1.0, 0))
+        client = make_client(stub, breaker_failure_threshold=1)
+        loop = asyncio.get_running_loop()
+        async with aiohttp.ClientSession(timeout=client.timeout) as session:
+            started = loop.time()
+            assert await client.get_kline_data(session, "SLOW", "60", deadline=started + 0.2) is None
+            assert loop.time() - started < 0.5
+
+            with pytest.raises(RequestSkipped):
+                await client.get_kline_data(session, "SLOW", "60", deadline=loop.time() - 1)
+
+        # 自分で切り詰めた期限によるタイムアウトは取引所の障害として数えない
+        assert client.kline_breaker.opened_at is None
+        counters = client.pop_counters()
+        assert counters["requests"] == 1
+        assert counters["deadline_skipped"] == 1
+
+    run(scenario)
+
+def test_abandoned_hedged_requests_do_not_leak_exceptions():
+    async def scenario(stub_factory):
+        # 1本目・ヘッジともタイムアウトより遅い。セッションのタイムアウトと期限が同時に切れる
+        stub = await stub_factory(kline_behaviour=lambda symbol, n: (0, 0) if symbol == "FAST" else (1.0, 0))
+        client = make_client(stub, request_timeout=0.3, breaker_failure_threshold=100, hedge_max_ratio=1.0)
+        async with aiohttp.ClientSession(timeout=client.timeout) as session:
+            for _ in range(20):
+                await client.get_kline_data(session, "FAST", "60")
+            results = await asyncio.gather(*(client.get_kline_data(session, f"SLOW{i}", "60") for i in range(10)))
+        assert results == [None] * 10
+        assert client.pop_counters()["hedged"] > 0
+
+    run(scenario)
+
+def test_full_request_timeout_counts_against_breaker():
+    async def scenario(stub_factory):
+        stub = await stub_factory(kline_behaviour=lambda symbol, n: (1.0, 0))
+        client = make_client(stub, request_timeout=0.2, breaker_failure_threshold=1)
+        async with aiohttp.ClientSession(timeout=client.timeout) as session:
+            assert await client.get_kline_data(session, "SLOW", "60") is None
+        assert client.kline_breaker.opened_at is not None
+
+    run(scenario)
+
+def make_service(stub: StubExchange, tmp_path, monkeypatch, **env) -> DataFetchService:
+    settings = {"TIMEFRAMES": "1h", "OHLCV_HISTORY_LIMIT": "5", "GAP_REPAIR_MAX_REQUESTS": "0", "CYCLE_BUDGET_SECONDS": "10"}
+    settings.update(env)
+    for key, value in settings.items():
+        monkeypatch.setenv(key, value)
+    config = AppConfig()
+    config.base_url = stub.base_url
+    client = BybitClient(config.base_url, logger, request_timeout=config.request_timeout_seconds)
+    repository = DatabaseRepository(tmp_path / "cmma.db", config.timeframes, logger)
+    return DataFetchService(client, repository, config, logger)
+
+def make_tickers(symbols):
+    return [
+        {"symbol": s, "lastPrice": "1", "prevPrice1h": "1", "prevPrice24h": "1", "price24hPcnt": "0",
+         "turnover24h": str(1000 - i), "volume24h": "1"}
+        for i, s in enumerate(symbols)
+    ]
+
+def test_batches_are_committed_as_responses_complete(tmp_path, monkeypatch):
+    async def scenario(stub_factory):
+        symbols = ["FAST1USDT", "FAST2USDT", "SLOW1USDT", "SLOW2USDT"]
+        stub = await stub_factory(
+            kline_behaviour=lambda symbol, n: (0.5 if symbol.startswith("SLOW") else 0, 0),
+            tickers=make_tickers(symbols),
+        )
+        service = make_service(stub, tmp_path, monkeypatch, COMMIT_BATCH_SYMBOLS="2", TOP_TICKERS_LIMIT="4")
+
+        commits = []
+        upsert = service.repository.upsert_ohlcv_data
+        loop = asyncio.get_running_loop()
+
+        def recording_upsert(timeframe, records):
+            commits.append((loop.time(), {rec[0] for rec in records}))
+            return upsert(timeframe, records)
+
+        service.repository.upsert_ohlcv_data = recording_upsert
+        started = loop.time()
+        await service.fetch_and_store_data()
+        service.repository.close()
+
+        assert [batch for _, batch in commits] == [{"FAST1USDT", "FAST2USDT"}, {"SLOW1USDT", "SLOW2USDT"}]
+        # 速い銘柄のバッチは遅い銘柄の応答を待たずにコミットされている
+        assert commits[0][0] - started < 0.4
+        assert commits[1][0] - started >= 0.5
+
+    run(scenario)
+
+def test_skipped_gap_repairs_do_not_use_up_attempts(tmp_path, monkeypatch):
+    async def scenario(stub_factory):
+        stub = await stub_factory()
+        service = make_service(stub, tmp_path, monkeypatch, GAP_REPAIR_MAX_REQUESTS="10", GAP_REPAIR_MAX_ATTEMPTS="3")
+        hour = 3_600_000
+        service.repository.upsert_ohlcv_data("1h", [("AUSDT", t * hour, 1, 1, 1, 1, 1, 1) for t in [0, 1, 2, 6, 7]])
+        service.repository.scan_gaps("1h", hour)
+
+        breaker = service.client.kline_breaker
+        breaker.opened_at = time.monotonic()
+        async with aiohttp.ClientSession(timeout=service.client.timeout) as session:
+            for _ in range(3):
+                await service._repair_gaps(session)
+
+        assert stub.calls["AUSDT"] == []
+        assert len(service.repository.get_pending_gaps(3, 10)) == 1
+        service.repository.close()
+
+    run(scenario)